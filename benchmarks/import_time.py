@@ -0,0 +1,87 @@
+"""
+Measures how long loading the QDMTK plugin takes, compared to setting up Django (which is deferred until
+a Django layer is created or an action is run).
+
+Each measure runs in a fresh interpreter (qgis must be importable) :
+
+    python benchmarks/import_time.py [--runs 10] [--output results.json]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Loads the plugin as QGIS does on startup
+PLUGIN_LOAD = """
+import time
+start = time.perf_counter()
+import qdmtk.plugin
+elapsed = time.perf_counter() - start
+import sys
+print(elapsed, int("django.contrib.gis" in sys.modules))
+"""
+
+# Sets up Django with the demo datamodels, as done on first use
+DJANGO_SETUP = """
+import time
+from qdmtk import prepare_django, register_datamodel
+from qdmtk.contrib.demo_models import config
+register_datamodel(config.PROJECTNAME_A, config.APPS_A, config.DATABASE_A)
+register_datamodel(config.PROJECTNAME_B, config.APPS_B, config.DATABASE_B)
+start = time.perf_counter()
+prepare_django()
+import qdmtk.provider
+elapsed = time.perf_counter() - start
+print(elapsed, 1)
+"""
+
+
+def measure(snippet, runs):
+    timings = []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, "-c", snippet],
+            cwd=ROOT,
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout.split()
+        timings.append(float(output[0]))
+    return {
+        "median_s": statistics.median(timings),
+        "min_s": min(timings),
+        "max_s": max(timings),
+        "loads_geodjango": bool(int(output[1])),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--output", help="path of the JSON file to write results to")
+    args = parser.parse_args()
+
+    results = {
+        "plugin_load": measure(PLUGIN_LOAD, args.runs),
+        "django_setup": measure(DJANGO_SETUP, args.runs),
+    }
+
+    for name, result in results.items():
+        print(
+            f"{name:<15} median {result['median_s'] * 1000:8.1f} ms "
+            f"(min {result['min_s'] * 1000:.1f}, max {result['max_s'] * 1000:.1f}) "
+            f"geodjango loaded: {result['loads_geodjango']}"
+        )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,340 @@
+"""
+Times the main paths of the Django provider on the demo datamodels (`Structure`/`Building` multi-table
+inheritance, `LandLot` with a foreign key to `Owner`), on Spatialite datasets of several sizes.
+
+Datasets are generated reproducibly (from `--seed`) in `--workdir`, and reused by later runs. Each size runs
+in a fresh interpreter, headless (only `qgis.core` is needed) :
+
+    python benchmarks/provider.py [--sizes 10000,100000,1000000] [--runs 5] [--output results.json]
+    python benchmarks/provider.py --layer-options "cache=1"  # benchmark layer options
+"""
+
+import argparse
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Extent of the generated geometries (EPSG:4326)
+EXTENT = (6.0, 45.8, 10.5, 47.8)
+
+# Number of features of the edits, FilterFids and bbox requests
+SAMPLE_SIZE = 1000
+
+# Size of the bbox requests, as a fraction of the extent's width/height
+BBOX_FRACTION = 0.05
+
+# Rows inserted per query when generating datasets
+GENERATE_BATCH_SIZE = 10000
+
+
+def setup(workdir, size, seed):
+    """Registers the demo datamodels on the dataset's databases and sets up Django"""
+    sys.path.insert(0, ROOT)
+    from qdmtk import prepare_django, register_datamodel
+    from qdmtk.contrib.demo_models import config
+
+    for key, apps in (
+        (config.PROJECTNAME_A, config.APPS_A),
+        (config.PROJECTNAME_B, config.APPS_B),
+    ):
+        register_datamodel(
+            key,
+            apps,
+            {
+                "ENGINE": "django.contrib.gis.db.backends.spatialite",
+                "NAME": os.path.join(workdir, f"{key}_{size}_{seed}.db"),
+            },
+        )
+    prepare_django()
+
+
+def generate(size, seed):
+    """Migrates the databases and fills them with `size` rows per layer, unless already done"""
+    from django.contrib.gis.geos import Point, Polygon
+    from django.core.management import call_command
+    from django.db import connections
+
+    from qdmtk import datamodels_registry
+    from qdmtk.contrib.demo_models.app_a.models import Building, Structure
+    from qdmtk.contrib.demo_models.app_b.models import Owner
+    from qdmtk.contrib.demo_models.app_c.models import LandLot
+
+    for key in datamodels_registry:
+        call_command("migrate", "--database", key, verbosity=0)
+    if Structure.objects.exists():
+        return
+
+    rng = random.Random(seed)
+    xmin, ymin, xmax, ymax = EXTENT
+
+    def point():
+        return (rng.uniform(xmin, xmax), rng.uniform(ymin, ymax))
+
+    # Structures, half of them being buildings (bulk_create doesn't support multi-table inheritance, so
+    # the buildings' rows are inserted directly)
+    for start in range(0, size, GENERATE_BATCH_SIZE):
+        count = min(GENERATE_BATCH_SIZE, size - start)
+        structures = []
+        for i in range(start, start + count):
+            structures.append(
+                Structure(
+                    id=i + 1,
+                    geom=Point(*point(), srid=4326),
+                    name=f"structure {i}",
+                    label=f"[{i + 1}] structure {i}",
+                )
+            )
+        Structure.objects.bulk_create(structures)
+        rows = [(s.id, rng.randint(1, 20)) for s in structures if s.id % 2 == 0]
+        with connections[Building.objects.db].cursor() as cursor:
+            cursor.executemany(
+                f"INSERT INTO {Building._meta.db_table} (structure_ptr_id, stories_count) VALUES (%s, %s)",
+                rows,
+            )
+
+    # Owners and land lots
+    owners_count = max(1, size // 10)
+    Owner.objects.bulk_create(
+        [Owner(id=i + 1, name=f"owner {i}") for i in range(owners_count)],
+        batch_size=GENERATE_BATCH_SIZE,
+    )
+    for start in range(0, size, GENERATE_BATCH_SIZE):
+        count = min(GENERATE_BATCH_SIZE, size - start)
+        lots = []
+        for i in range(start, start + count):
+            x, y = point()
+            side = rng.uniform(0.0001, 0.001)
+            lots.append(
+                LandLot(
+                    id=i + 1,
+                    geom=Polygon.from_bbox((x, y, x + side, y + side)),
+                    owner_id=rng.randint(1, owners_count),
+                )
+            )
+        LandLot.objects.bulk_create(lots)
+
+    # Statistics used by estimated metadata
+    for key in datamodels_registry:
+        with connections[key].cursor() as cursor:
+            cursor.execute("SELECT UpdateLayerStatistics()")
+
+
+def timed(function, runs):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return {
+        "median_s": statistics.median(timings),
+        "min_s": min(timings),
+        "max_s": max(timings),
+    }
+
+
+def run_benchmarks(size, seed, runs, layer_options):
+    from qgis.core import (
+        QgsApplication,
+        QgsFeature,
+        QgsFeatureRequest,
+        QgsGeometry,
+        QgsProviderMetadata,
+        QgsProviderRegistry,
+        QgsRectangle,
+        QgsVectorLayer,
+    )
+
+    from qdmtk import PROVIDER_DESCRIPTION, PROVIDER_KEY
+    from qdmtk.plugin import create_provider
+
+    app = QgsApplication([], False)
+    app.initQgis()
+    QgsProviderRegistry.instance().registerProvider(
+        QgsProviderMetadata(PROVIDER_KEY, PROVIDER_DESCRIPTION, create_provider)
+    )
+
+    # layers are kept referenced, as they own their providers
+    layers = []
+
+    def layer(model_label):
+        uri = f"{model_label}?{layer_options}" if layer_options else model_label
+        layer = QgsVectorLayer(uri, model_label, PROVIDER_KEY)
+        assert layer.isValid(), f"Could not load {uri}"
+        layers.append(layer)
+        return layer
+
+    rng = random.Random(seed)
+    xmin, ymin, xmax, ymax = EXTENT
+    width, height = (xmax - xmin) * BBOX_FRACTION, (ymax - ymin) * BBOX_FRACTION
+
+    def bbox_request():
+        x = rng.uniform(xmin, xmax - width)
+        y = rng.uniform(ymin, ymax - height)
+        return QgsFeatureRequest(QgsRectangle(x, y, x + width, y + height))
+
+    def iterate(layer, request=None):
+        return sum(1 for _ in layer.getFeatures(request or QgsFeatureRequest()))
+
+    results = {}
+    for label in ("app_a.Structure", "app_a.Building", "app_c.LandLot"):
+        provider = layer(label).dataProvider()
+        fids = rng.sample(range(1, size + 1), min(SAMPLE_SIZE, size))
+
+        def count_and_extent():
+            provider.reloadData()
+            provider.featureCount()
+            provider.updateExtents()
+            provider.extent()
+
+        results[label] = {
+            "full_iteration": timed(lambda: iterate(provider), runs),
+            "bbox_iteration": timed(lambda: iterate(provider, bbox_request()), runs),
+            "filter_fids": timed(
+                lambda: iterate(provider, QgsFeatureRequest().setFilterFids(fids)),
+                runs,
+            ),
+            "count_and_extent": timed(count_and_extent, runs),
+        }
+
+    # Edits on land lots (added features are deleted afterwards, so the dataset is unchanged)
+    provider = layer("app_c.LandLot").dataProvider()
+    fields = provider.fields()
+    owner_index = fields.indexOf("owner")
+
+    def features():
+        result = []
+        for _ in range(SAMPLE_SIZE):
+            f = QgsFeature(fields)
+            x, y = rng.uniform(xmin, xmax), rng.uniform(ymin, ymax)
+            f.setGeometry(
+                QgsGeometry.fromRect(QgsRectangle(x, y, x + 0.001, y + 0.001))
+            )
+            f.setAttribute(owner_index, 1)
+            result.append(f)
+        return result
+
+    added = []
+
+    def add_features():
+        ok, flist = provider.addFeatures(features())
+        assert ok
+        added.extend(f.id() for f in flist)
+
+    def change_attribute_values():
+        changes = {
+            fid: {owner_index: rng.randint(1, max(1, size // 10))}
+            for fid in added[:SAMPLE_SIZE]
+        }
+        assert provider.changeAttributeValues(changes)
+
+    def delete_features():
+        assert provider.deleteFeatures(added[:SAMPLE_SIZE])
+        del added[:SAMPLE_SIZE]
+
+    # each run of a step uses the features added by the same run of the previous step
+    results["app_c.LandLot"]["add_features"] = timed(add_features, runs)
+    results["app_c.LandLot"]["change_attribute_values"] = timed(
+        change_attribute_values, runs
+    )
+    results["app_c.LandLot"]["delete_features"] = timed(delete_features, runs)
+    del added[:]
+
+    del layers[:]
+    app.exitQgis()
+    return results
+
+
+def child(args):
+    """Runs the benchmarks of one size, printing the results as JSON"""
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    setup(args.workdir, args.size, args.seed)
+    start = time.perf_counter()
+    generate(args.size, args.seed)
+    generation_s = time.perf_counter() - start
+    results = run_benchmarks(args.size, args.seed, args.runs, args.layer_options)
+    print(json.dumps({"generation_s": generation_s, "layers": results}))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "--sizes",
+        default="10000,100000",
+        help="comma separated numbers of rows, up to 5000000",
+    )
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--workdir", default=os.path.join(tempfile.gettempdir(), "qdmtk_benchmarks")
+    )
+    parser.add_argument(
+        "--layer-options", default="", help="options appended to the layers uri"
+    )
+    parser.add_argument("--output", help="path of the JSON file to write results to")
+    parser.add_argument("--size", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.size is not None:
+        child(args)
+        return
+
+    os.makedirs(args.workdir, exist_ok=True)
+    commit = subprocess.run(
+        ["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True
+    ).stdout.strip()
+    results = {
+        "commit": commit,
+        "python": sys.version.split()[0],
+        "runs": args.runs,
+        "seed": args.seed,
+        "layer_options": args.layer_options,
+        "sizes": {},
+    }
+    for size in (int(s) for s in args.sizes.split(",")):
+        output = subprocess.run(
+            [
+                sys.executable,
+                os.path.abspath(__file__),
+                "--size",
+                str(size),
+                "--runs",
+                str(args.runs),
+                "--seed",
+                str(args.seed),
+                "--workdir",
+                args.workdir,
+                "--layer-options",
+                args.layer_options,
+            ],
+            cwd=ROOT,
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout
+        # the results are the last line (QGIS may print messages before)
+        size_results = json.loads(output.strip().splitlines()[-1])
+        results["sizes"][str(size)] = size_results
+
+        for label, layer_results in size_results["layers"].items():
+            for name, result in layer_results.items():
+                print(
+                    f"{size:>8} {label:<16} {name:<24} median {result['median_s'] * 1000:10.1f} ms "
+                    f"(min {result['min_s'] * 1000:.1f}, max {result['max_s'] * 1000:.1f})"
+                )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,22 @@
 import os
+import sys
 
 from .version import __version__  # noqa
 
+# NOTE : this module must stay lightweight (no Django imports at module level), as it's imported on QGIS
+# startup. Django is only set up when first needed.
+
 # This will hold all registered datamodels
 datamodels_registry = {}
 
+# Key and description of the Django provider
+PROVIDER_KEY = "qdmtk_provider"
+PROVIDER_DESCRIPTION = "QDMTK Provider"
+
+# Key and description of the hybrid provider (native reads, Django writes)
+HYBRID_PROVIDER_KEY = "qdmtk_hybrid"
+HYBRID_PROVIDER_DESCRIPTION = "QDMTK Hybrid Provider"
+
 
 def classFactory(iface):
     from .plugin import Plugin
@@ -17,11 +29,9 @@ def register_datamodel(datamodel_key, installed_apps, db_settings):
     This registers the database connection and installed apps for the given datamodel.
     These will be used to configure Django when prepare_django() is called.
     """
-    from django.apps import apps
-
     from .exceptions import QDMTKException
 
-    if apps.ready:
+    if _django_ready():
         raise QDMTKException(
             "Django was already setup. Ensure `prepare_django` is only called after all datamodels are registered."
         )
@@ -32,18 +42,24 @@ def register_datamodel(datamodel_key, installed_apps, db_settings):
     }
 
 
+def _django_ready():
+    # Django can't be set up if it wasn't even imported, this avoids importing it
+    django_apps = sys.modules.get("django.apps")
+    return django_apps is not None and django_apps.apps.ready
+
+
 def prepare_django():
     """
-    Sets up Django with all registered apps and database settings
+    Sets up Django with all registered apps and database settings. This is idempotent, and is called
+    lazily by the plugin when Django is first needed.
     """
-    import django
-    from django.apps import apps
-    from django.conf import settings
-
-    if apps.ready:
+    if _django_ready():
         # already done
         return
 
+    import django
+    from django.conf import settings
+
     # Allow to configure GDAL/GEOS/Spatialite libraries from env vars
     # see https://docs.djangoproject.com/en/3.2/ref/contrib/gis/install/geolibs/#geos-library-path
     GDAL_LIBRARY_PATH_ENV = os.getenv("GDAL_LIBRARY_PATH")
@@ -57,8 +73,19 @@ def prepare_django():
     if SPATIALITE_LIBRARY_PATH_ENV:
         additionnal_settings["SPATIALITE_LIBRARY_PATH"] = SPATIALITE_LIBRARY_PATH_ENV
 
-    # Collect all databases
-    databases = {k: v["db_settings"] for k, v in datamodels_registry.items()}
+    from .pool import configure_database, find_spatialite_library, watch_connections
+
+    # Collect all databases, with persistent connections
+    databases = {
+        k: configure_database(v["db_settings"]) for k, v in datamodels_registry.items()
+    }
+
+    # Resolve the Spatialite extension once, instead of on each new connection
+    uses_spatialite = any("spatialite" in db["ENGINE"] for db in databases.values())
+    if uses_spatialite and "SPATIALITE_LIBRARY_PATH" not in additionnal_settings:
+        spatialite_library = find_spatialite_library()
+        if spatialite_library:
+            additionnal_settings["SPATIALITE_LIBRARY_PATH"] = spatialite_library
     # Contactenate apps from all datamodels
     installed_apps = []
     for datamodel in datamodels_registry.values():
@@ -81,3 +108,9 @@ def prepare_django():
         **additionnal_settings,
     )
     django.setup()
+    watch_connections()
+
+    # Index the models and their databases for routing
+    from .router import build_index
+
+    build_index()
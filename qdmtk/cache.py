@@ -0,0 +1,299 @@
+"""
+In-process cache of feature blocks, feature counts and extents, for layers using the `cache` option.
+
+Feature blocks hold the rows (as returned by the read query, with all columns) of either the whole layer
+or of a tile of a grid aligned on the layer's extent, so that panning and zooming reuses the blocks. The
+cache has a bounded size with LRU eviction. Entries are invalidated by the provider's edit methods and by
+Django's `post_save`/`post_delete` signals (so that edits made through the ORM are seen too). Note that
+`post_delete` receivers prevent Django from using fast deletes for the cached models, whose deleted rows are
+loaded to send the signals. Entries of layers filtered by a subset string are invalidated by any change of
+the group, as changed rows may enter or leave the subset.
+"""
+
+import math
+import threading
+from collections import OrderedDict, defaultdict
+
+from django.apps import apps
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from qgis.core import QgsRectangle
+
+from .schema import find_display_field
+
+# Default maximum size of the cache, in bytes (estimated)
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+# Finest zoom level of the tiles grid
+MAX_ZOOM = 16
+
+# Requests covering more tiles than this bypass the cache
+MAX_TILES = 16
+
+# Estimated size of each row's overhead and of each (non geometry) value
+ROW_OVERHEAD_BYTES = 64
+VALUE_BYTES = 16
+
+
+def cache_group(model):
+    """
+    Returns the label of the root model of the model's multi-table inheritance hierarchy. Edits on any
+    model of the group invalidate the entries of all models of the group, as they share tables.
+    """
+    parents = model._meta.get_parent_list()
+    root = parents[-1] if parents else model
+    return root._meta.label
+
+
+def cache_key(model, kind, subset_string, shape=None, columns=()):
+    """
+    Returns the key of an entry, `kind` being one of "features", "count", "extent" or "grid", `shape`
+    identifying the feature block and `columns` the computed columns of the rows (which depend on the
+    layer options)
+    """
+    return (cache_group(model), model._meta.label, kind, subset_string, shape, columns)
+
+
+def row_size(row):
+    return ROW_OVERHEAD_BYTES + sum(
+        len(value) if isinstance(value, (bytes, memoryview)) else VALUE_BYTES
+        for value in row
+    )
+
+
+class Entry:
+    def __init__(self, group, value, size, fids=None, rect=None):
+        self.group = group
+        self.value = value
+        self.size = size
+        # fids contained in a feature block
+        self.fids = fids
+        # rect of a tile block (None for blocks of the whole layer)
+        self.rect = rect
+
+
+class FeatureCache:
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.RLock()
+        self._watched = set()
+        # Incremented on each invalidation of a group, so that blocks fetched meanwhile are not stored
+        self._generations = defaultdict(int)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry.value
+
+    def generation(self, key):
+        return self._generations[key[0]]
+
+    def put(self, key, value, size=0, fids=None, rect=None, generation=None):
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if generation is not None and generation != self._generations[key[0]]:
+                # the entry was invalidated while it was computed
+                return
+            self._remove(key)
+            self._entries[key] = Entry(key[0], value, size, fids, rect)
+            self._size += size
+            while self._size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def invalidate(self, model, fids=(), rects=(), created=False, deleted=False):
+        """
+        Invalidates the entries affected by changes of the model's rows : feature blocks containing the
+        fids or whose tile intersects one of the rects (bounding boxes of the new geometries), extents
+        not containing the rects, counts if rows were created or deleted, and all entries of layers
+        filtered by a subset string.
+        """
+        group = cache_group(model)
+        fids = set(fids)
+        with self._lock:
+            self._generations[group] += 1
+            for key, entry in list(self._entries.items()):
+                if entry.group != group:
+                    continue
+                kind = key[2]
+                if key[3] and kind != "grid":
+                    # changed rows may enter or leave the subset
+                    self._remove(key)
+                elif kind == "features":
+                    if (
+                        (created and entry.rect is None)
+                        or not fids.isdisjoint(entry.fids)
+                        or any(entry.rect and entry.rect.intersects(r) for r in rects)
+                    ):
+                        self._remove(key)
+                elif kind == "extent":
+                    if deleted or not all(entry.value.contains(r) for r in rects):
+                        self._remove(key)
+                elif kind == "count":
+                    if created or deleted:
+                        self._remove(key)
+
+    def invalidate_all(self, model):
+        group = cache_group(model)
+        with self._lock:
+            self._generations[group] += 1
+            for key, entry in list(self._entries.items()):
+                if entry.group == group and key[2] != "grid":
+                    self._remove(key)
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._size -= entry.size
+
+    def watch(self, model, geom_field):
+        """
+        Connects the signals invalidating the entries of the model when rows are saved or deleted through
+        the ORM, including rows of other models of the same inheritance hierarchy, and rows referenced by
+        foreign keys (whose deletion may cascade or set the foreign keys to NULL, and whose display values
+        may be joined).
+        """
+        with self._lock:
+            if model in self._watched:
+                return
+            self._watched.add(model)
+
+        group = cache_group(model)
+
+        def on_save(sender, instance, created, using, **kwargs):
+            self.invalidate_on_commit(
+                model,
+                using,
+                fids=[instance.pk],
+                rects=self._instance_rects(instance, geom_field),
+                created=created,
+            )
+
+        def on_delete(sender, instance, using, **kwargs):
+            self.invalidate_on_commit(model, using, fids=[instance.pk], deleted=True)
+
+        def on_related_change(sender, instance, using, **kwargs):
+            self.invalidate_all(model)
+            transaction.on_commit(lambda: self.invalidate_all(model), using=using)
+
+        uid = f"qdmtk_cache_{model._meta.label}"
+        for other in apps.get_models():
+            if cache_group(other) == group:
+                post_save.connect(
+                    on_save, sender=other, weak=False, dispatch_uid=f"{uid}_save"
+                )
+                post_delete.connect(
+                    on_delete, sender=other, weak=False, dispatch_uid=f"{uid}_delete"
+                )
+        for field in model._meta.get_fields():
+            if field.many_to_one and field.concrete:
+                post_delete.connect(
+                    on_related_change,
+                    sender=field.related_model,
+                    weak=False,
+                    dispatch_uid=f"{uid}_related_delete",
+                )
+                if find_display_field(field) is not None:
+                    # display values of the referenced rows may be joined (`display_fields` option)
+                    post_save.connect(
+                        on_related_change,
+                        sender=field.related_model,
+                        weak=False,
+                        dispatch_uid=f"{uid}_related_save",
+                    )
+
+    def invalidate_referencing(self, model, using):
+        """
+        Invalidates the entries of the watched models with foreign keys to the model's group, as deleting
+        its rows may cascade to them, and changing them may change their joined display values
+        """
+        group = cache_group(model)
+        with self._lock:
+            referencing = [
+                other
+                for other in self._watched
+                if any(
+                    field.many_to_one
+                    and field.concrete
+                    and cache_group(field.related_model) == group
+                    for field in other._meta.get_fields()
+                )
+            ]
+        for other in referencing:
+            self.invalidate_all(other)
+            transaction.on_commit(
+                lambda other=other: self.invalidate_all(other), using=using
+            )
+
+    def invalidate_on_commit(self, model, using, **kwargs):
+        """
+        Invalidates the entries now, and again once the current transaction is committed, as entries may
+        have been refilled meanwhile from other connections
+        """
+        self.invalidate(model, **kwargs)
+        transaction.on_commit(lambda: self.invalidate(model, **kwargs), using=using)
+
+    def _instance_rects(self, instance, geom_field):
+        geometry = getattr(instance, geom_field.name, None) if geom_field else None
+        if geometry is None or not hasattr(geometry, "extent"):
+            return []
+        return [QgsRectangle(*geometry.extent)]
+
+
+def tiles(grid, rect):
+    """
+    Returns the `((zoom, x, y), tile_rect)` tuples of the tiles covering the rect, using tiles at least as
+    big as the rect. The grid is the (xmin, ymin, width, height) of the zoom 0 tile. Returns None if
+    there would be too many tiles.
+    """
+    xmin, ymin, width, height = grid
+    if width <= 0 or height <= 0:
+        return None
+
+    zoom = 0
+    while (
+        zoom < MAX_ZOOM
+        and width / 2 ** (zoom + 1) >= rect.width()
+        and height / 2 ** (zoom + 1) >= rect.height()
+    ):
+        zoom += 1
+    tile_width, tile_height = width / 2**zoom, height / 2**zoom
+
+    xs = range(
+        math.floor((rect.xMinimum() - xmin) / tile_width),
+        math.floor((rect.xMaximum() - xmin) / tile_width) + 1,
+    )
+    ys = range(
+        math.floor((rect.yMinimum() - ymin) / tile_height),
+        math.floor((rect.yMaximum() - ymin) / tile_height) + 1,
+    )
+    if len(xs) * len(ys) > MAX_TILES:
+        return None
+
+    return [
+        (
+            (zoom, x, y),
+            QgsRectangle(
+                xmin + x * tile_width,
+                ymin + y * tile_height,
+                xmin + (x + 1) * tile_width,
+                ymin + (y + 1) * tile_height,
+            ),
+        )
+        for x in xs
+        for y in ys
+    ]
+
+
+# Cache shared by all layers
+feature_cache = FeatureCache()
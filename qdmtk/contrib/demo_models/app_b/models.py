@@ -3,6 +3,7 @@ from django.contrib.gis.db import models
 
 class Owner(models.Model):
     qdmtk_addlayer = True
+    qdmtk_display_field = "name"
 
     id = models.BigAutoField(primary_key=True)
     name = models.CharField(max_length=255)
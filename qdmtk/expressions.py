@@ -0,0 +1,304 @@
+from django.contrib.gis.db import models
+from django.contrib.gis.geos import GEOSException, GEOSGeometry
+from django.core.exceptions import ValidationError
+from django.db.models import F, OrderBy, Q
+from qgis.core import (
+    QgsExpression,
+    QgsExpressionNode,
+    QgsExpressionNodeBinaryOperator,
+    QgsExpressionNodeUnaryOperator,
+)
+from qgis.PyQt.QtCore import QVariant
+
+BinaryOperator = QgsExpressionNodeBinaryOperator.BinaryOperator
+
+# Comparison operators, mapped to the django lookup (and to the lookup to use when operands are swapped)
+COMPARISONS = {
+    BinaryOperator.boEQ: ("exact", "exact"),
+    BinaryOperator.boGT: ("gt", "lt"),
+    BinaryOperator.boGE: ("gte", "lte"),
+    BinaryOperator.boLT: ("lt", "gt"),
+    BinaryOperator.boLE: ("lte", "gte"),
+}
+
+# Like operators, mapped to (case insensitive, negated)
+LIKES = {
+    BinaryOperator.boLike: (False, False),
+    BinaryOperator.boNotLike: (False, True),
+    BinaryOperator.boILike: (True, False),
+    BinaryOperator.boNotILike: (True, True),
+}
+
+# Spatial predicates functions, mapped to the django lookup (and to the lookup to use when arguments are swapped)
+SPATIAL_PREDICATES = {
+    "intersects": ("intersects", "intersects"),
+    "disjoint": ("disjoint", "disjoint"),
+    "touches": ("touches", "touches"),
+    "crosses": ("crosses", "crosses"),
+    "overlaps": ("overlaps", "overlaps"),
+    "equals": ("equals", "equals"),
+    "contains": ("contains", "within"),
+    "within": ("within", "contains"),
+    "bbox": ("bboverlaps", "bboverlaps"),
+}
+
+
+class Unsupported(Exception):
+    """Raised when (part of) an expression can't be translated to the ORM"""
+
+
+def is_null(value):
+    return value is None or (isinstance(value, QVariant) and value.isNull())
+
+
+class ExpressionCompiler:
+    """
+    Translates the supported subset of a QgsExpression to a Django Q object.
+
+    Expressions can be partially translated (e.g. one side of an AND), in which case the resulting Q object
+    only prefilters the rows (it never excludes rows matching the expression), and the expression still
+    needs to be evaluated client-side.
+    """
+
+    def __init__(self, model, attrs, geom_field, vendor):
+        self.model = model
+        self.attrs = {attr.name: attr for attr in attrs}
+        self.geom_field = geom_field
+        self.vendor = vendor
+
+    def compile(self, expression):
+        """
+        Returns a `(q, complete)` tuple, where `q` is None if nothing could be translated, and `complete`
+        tells whether `q` matches exactly the expression (so that no client-side evaluation is needed).
+        """
+        if (
+            expression is None
+            or expression.hasParserError()
+            or not expression.rootNode()
+        ):
+            return None, False
+        try:
+            return self._compile(expression.rootNode())
+        except Unsupported:
+            return None, False
+
+    def compile_order_by(self, order_bys):
+        """
+        Returns the list of django order by expressions matching the QgsFeatureRequest.OrderBy clauses,
+        or None if some clause can't be translated.
+        """
+        ordering = []
+        for clause in order_bys:
+            expression = clause.expression()
+            if expression.hasParserError() or not expression.rootNode():
+                return None
+            try:
+                name = self._column(expression.rootNode())
+            except Unsupported:
+                return None
+            # only one of nulls_first/nulls_last may be set (Django >= 5.0 rejects False)
+            ordering.append(
+                OrderBy(
+                    F(name),
+                    descending=not clause.ascending(),
+                    nulls_first=True if clause.nullsFirst() else None,
+                    nulls_last=None if clause.nullsFirst() else True,
+                )
+            )
+        return ordering
+
+    def _compile(self, node):
+        node_type = node.nodeType()
+        if node_type == QgsExpressionNode.NodeType.ntBinaryOperator:
+            return self._compile_binary(node)
+        if node_type == QgsExpressionNode.NodeType.ntUnaryOperator:
+            return self._compile_unary(node)
+        if node_type == QgsExpressionNode.NodeType.ntInOperator:
+            return self._compile_in(node)
+        if node_type == QgsExpressionNode.NodeType.ntFunction:
+            return self._compile_spatial_predicate(node)
+        raise Unsupported()
+
+    def _compile_binary(self, node):
+        op = node.op()
+
+        if op == BinaryOperator.boAnd:
+            left, left_complete = self._compile_or_skip(node.opLeft())
+            right, right_complete = self._compile_or_skip(node.opRight())
+            if left is None and right is None:
+                raise Unsupported()
+            if left is None:
+                return right, False
+            if right is None:
+                return left, False
+            return left & right, left_complete and right_complete
+
+        if op == BinaryOperator.boOr:
+            left, left_complete = self._compile(node.opLeft())
+            right, right_complete = self._compile(node.opRight())
+            return left | right, left_complete and right_complete
+
+        if op in (BinaryOperator.boIs, BinaryOperator.boIsNot):
+            name = self._column(node.opLeft())
+            if not is_null(self._literal(node.opRight())):
+                raise Unsupported()
+            return Q(**{f"{name}__isnull": op == BinaryOperator.boIs}), True
+
+        if op in COMPARISONS:
+            return self._compile_comparison(node.opLeft(), node.opRight(), op)
+
+        if op == BinaryOperator.boNE:
+            name, value = self._column_and_value(node.opLeft(), node.opRight())
+            # SQL's NOT is not null-safe, so nulls are excluded explicitly as QGIS does
+            return Q(**{f"{name}__isnull": False}) & ~Q(**{name: value}), True
+
+        if op in LIKES:
+            return self._compile_like(node, *LIKES[op])
+
+        raise Unsupported()
+
+    def _compile_unary(self, node):
+        if node.op() != QgsExpressionNodeUnaryOperator.UnaryOperator.uoNot:
+            raise Unsupported()
+        q, complete = self._compile(node.operand())
+        if not complete:
+            # negating a prefilter could exclude matching rows
+            raise Unsupported()
+        # Django's negation also keeps rows evaluating to NULL, hence this is only a prefilter
+        return ~q, False
+
+    def _compile_in(self, node):
+        name = self._column(node.node())
+        values = [self._value(name, self._literal(item)) for item in node.list().list()]
+        if node.isNotIn():
+            return Q(**{f"{name}__isnull": False}) & ~Q(**{f"{name}__in": values}), True
+        return Q(**{f"{name}__in": values}), True
+
+    def _compile_comparison(self, left, right, op):
+        lookup, swapped_lookup = COMPARISONS[op]
+        try:
+            name, value = self._column(left), self._literal(right)
+        except Unsupported:
+            name, value, lookup = (
+                self._column(right),
+                self._literal(left),
+                swapped_lookup,
+            )
+        return Q(**{f"{name}__{lookup}": self._value(name, value)}), True
+
+    def _compile_like(self, node, insensitive, negated):
+        name = self._column(node.opLeft())
+        if not isinstance(self._field(name), (models.CharField, models.TextField)):
+            raise Unsupported()
+        pattern = self._literal(node.opRight())
+        if not isinstance(pattern, str) or "_" in pattern or "\\" in pattern:
+            raise Unsupported()
+
+        starts = pattern.startswith("%")
+        ends = len(pattern) > 1 and pattern.endswith("%")
+        value = pattern[1 if starts else 0 : -1 if ends else None]
+        if "%" in value:
+            raise Unsupported()
+        if starts and ends:
+            lookup = "contains"
+        elif starts:
+            lookup = "endswith"
+        elif ends:
+            lookup = "startswith"
+        else:
+            lookup = "exact"
+        if insensitive:
+            lookup = f"i{lookup}"
+
+        q = Q(**{f"{name}__{lookup}": value})
+        # Pattern lookups are always case insensitive on SQLite
+        complete = insensitive or lookup == "exact" or self.vendor != "sqlite"
+        if negated:
+            if not complete:
+                raise Unsupported()
+            return Q(**{f"{name}__isnull": False}) & ~q, True
+        return q, complete
+
+    def _compile_spatial_predicate(self, node):
+        name = self._function_name(node)
+        if name not in SPATIAL_PREDICATES or self.geom_field is None:
+            raise Unsupported()
+        lookup, swapped_lookup = SPATIAL_PREDICATES[name]
+        left, right = self._args(node, 2)
+        if self._is_function(left, "$geometry"):
+            geometry = self._geometry_literal(right)
+        elif self._is_function(right, "$geometry"):
+            geometry, lookup = self._geometry_literal(left), swapped_lookup
+        else:
+            raise Unsupported()
+        return Q(**{f"{self.geom_field.name}__{lookup}": geometry}), True
+
+    def _compile_or_skip(self, node):
+        try:
+            return self._compile(node)
+        except Unsupported:
+            return None, False
+
+    def _column_and_value(self, left, right):
+        try:
+            name, value = self._column(left), self._literal(right)
+        except Unsupported:
+            name, value = self._column(right), self._literal(left)
+        return name, self._value(name, value)
+
+    def _column(self, node):
+        """returns the model field name referenced by a column ref or `$id` node"""
+        if self._is_function(node, "$id"):
+            return "pk"
+        if node.nodeType() != QgsExpressionNode.NodeType.ntColumnRef:
+            raise Unsupported()
+        if node.name() not in self.attrs:
+            raise Unsupported()
+        return node.name()
+
+    def _field(self, name):
+        if name == "pk":
+            return self.model._meta.pk
+        return self.attrs[name]
+
+    def _literal(self, node):
+        if node.nodeType() != QgsExpressionNode.NodeType.ntLiteral:
+            raise Unsupported()
+        return node.value()
+
+    def _value(self, name, value):
+        """validates a literal against the field, as QGIS comparisons with NULL never match"""
+        if is_null(value):
+            raise Unsupported()
+        try:
+            self._field(name).get_prep_value(value)
+        except (TypeError, ValueError, ValidationError):
+            raise Unsupported()
+        return value
+
+    def _geometry_literal(self, node):
+        if not self._is_function(node, "geom_from_wkt"):
+            raise Unsupported()
+        (wkt_node,) = self._args(node, 1)
+        wkt = self._literal(wkt_node)
+        if not isinstance(wkt, str):
+            raise Unsupported()
+        try:
+            return GEOSGeometry(wkt, srid=self.geom_field.srid)
+        except (GEOSException, ValueError):
+            raise Unsupported()
+
+    def _args(self, node, count):
+        args = node.args().list() if node.args() else []
+        if len(args) != count:
+            raise Unsupported()
+        return args
+
+    def _is_function(self, node, name):
+        return (
+            node.nodeType() == QgsExpressionNode.NodeType.ntFunction
+            and self._function_name(node) == name
+        )
+
+    def _function_name(self, node):
+        return QgsExpression.Functions()[node.fnIndex()].name().lower()
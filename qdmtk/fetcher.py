@@ -0,0 +1,211 @@
+"""
+Background fetching of feature rows, for layers using the `background_fetch` option.
+
+Queries run on a pool of worker threads, each using its own Django connections (connections are
+thread-local, and kept open by the connections pool, see `pool`). Rows are passed to the iterator by chunks through a bounded queue, so that the next chunk is
+fetched while QGIS processes the current one. The running query is cancelled on the database when the
+iterator is closed, when the request's feedback is canceled or when the request's timeout expires. Jobs
+whose iterator stops reading rows give up after `CONSUMER_TIMEOUT`, so that they don't hold a worker and a
+connection indefinitely.
+"""
+
+import os
+import queue
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import DatabaseError
+from qgis.core import QgsMessageLog
+
+from .pool import PoolTimeout, pooled
+from .utils import stream_rows
+
+# Number of worker threads (shared by all layers)
+DEFAULT_WORKERS = min(8, os.cpu_count() or 1)
+
+# Number of chunks fetched ahead of the iterator
+PREFETCH_CHUNKS = 2
+
+# Interval at which the iterator checks for cancellation while waiting for rows, in seconds
+POLL_INTERVAL = 0.05
+
+# Seconds a job waits for its iterator to read the fetched rows before giving up
+CONSUMER_TIMEOUT = 60
+
+_executor = None
+_executor_lock = threading.Lock()
+
+# Jobs submitted to the executor, cancelled on shutdown
+_jobs = weakref.WeakSet()
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=DEFAULT_WORKERS, thread_name_prefix="qdmtk_fetch"
+            )
+        return _executor
+
+
+def shutdown():
+    """Cancels the pending fetches and stops the workers (called when the plugin is unloaded)"""
+    global _executor
+    with _executor_lock:
+        # queued jobs return right away once cancelled (`cancel_futures` needs Python 3.9)
+        for job in list(_jobs):
+            job.cancel()
+        if _executor is not None:
+            _executor.shutdown(wait=False)
+            _executor = None
+
+
+class FetchJob:
+    """
+    Fetches the rows of a query on a worker thread, putting them by chunks in a bounded queue
+    """
+
+    # Marks the end of the rows in the queue
+    DONE = object()
+
+    def __init__(self, query, alias, chunk_size):
+        self.query = query
+        self.alias = alias
+        self.chunk_size = chunk_size
+        self.chunks = queue.Queue(maxsize=PREFETCH_CHUNKS)
+        self.cancelled = threading.Event()
+        # set when the job gave up because the iterator didn't read the rows
+        self.abandoned = threading.Event()
+        # set once all rows are in the queue
+        self.finished = threading.Event()
+        self._connection = None
+        self._lock = threading.Lock()
+
+    def run(self):
+        if self.cancelled.is_set():
+            return
+        try:
+            with pooled(self.alias) as connection:
+                # the job may have been cancelled while waiting for a connection
+                if not self.cancelled.is_set():
+                    self._run(connection)
+        except PoolTimeout as e:
+            self._put(e)
+
+    def _run(self, connection):
+        with self._lock:
+            self._connection = connection
+        try:
+            if self.chunk_size > 0:
+                rows = stream_rows(self.query, self.chunk_size)
+                try:
+                    chunk = []
+                    for row in rows:
+                        chunk.append(row)
+                        if len(chunk) >= self.chunk_size:
+                            if not self._put(chunk):
+                                return
+                            chunk = []
+                finally:
+                    # releases the server-side cursor
+                    rows.close()
+                if chunk and not self._put(chunk):
+                    return
+            elif not self._put(list(self.query)):
+                return
+            with self._lock:
+                # the query is done, so cancelling must not interrupt the connection anymore
+                self._connection = None
+            self.finished.set()
+            self._put(self.DONE)
+        except DatabaseError as e:
+            if not self.cancelled.is_set():
+                self._put(e)
+        except Exception as e:
+            self._put(e)
+        finally:
+            with self._lock:
+                self._connection = None
+
+    def _put(self, item):
+        """
+        puts an item in the queue, returns False if the job was cancelled meanwhile or if the iterator didn't
+        read the queue within `CONSUMER_TIMEOUT`
+        """
+        deadline = time.monotonic() + CONSUMER_TIMEOUT
+        while not self.cancelled.is_set():
+            try:
+                self.chunks.put(item, timeout=POLL_INTERVAL)
+                return True
+            except queue.Full:
+                if time.monotonic() > deadline:
+                    self.abandoned.set()
+                    self.cancelled.set()
+                    return False
+        return False
+
+    def cancel(self):
+        """stops the job, interrupting the running query if any"""
+        if self.cancelled.is_set():
+            return
+        self.cancelled.set()
+        with self._lock:
+            if self._connection is not None:
+                cancel_query(self._connection)
+
+
+def cancel_query(connection):
+    """
+    Interrupts the query running on the connection, from another thread
+    """
+    raw_connection = connection.connection
+    if raw_connection is None:
+        return
+    try:
+        if connection.vendor == "postgresql":
+            raw_connection.cancel()
+        elif connection.vendor == "sqlite":
+            raw_connection.interrupt()
+    except Exception as e:
+        QgsMessageLog.logMessage(f"Could not cancel query ({e})", "QDMTK")
+
+
+def fetch_rows(query, alias, chunk_size, feedback=None, timeout=-1):
+    """
+    Yields the rows of the query, fetched by a worker thread. Stops early (cancelling the query) if the
+    feedback is canceled or after `timeout` milliseconds (if positive).
+    """
+    job = FetchJob(query, alias, chunk_size)
+    deadline = time.monotonic() + timeout / 1000 if timeout > 0 else None
+
+    def interrupted():
+        return (feedback is not None and feedback.isCanceled()) or (
+            deadline is not None and time.monotonic() > deadline
+        )
+
+    with _executor_lock:
+        _jobs.add(job)
+    get_executor().submit(job.run)
+    try:
+        while not interrupted():
+            try:
+                item = job.chunks.get(timeout=POLL_INTERVAL)
+            except queue.Empty:
+                if job.abandoned.is_set():
+                    if not job.finished.is_set():
+                        QgsMessageLog.logMessage(
+                            f"Stopped fetching features, as they weren't read for {CONSUMER_TIMEOUT}s",
+                            "QDMTK",
+                        )
+                    return
+                continue
+            if item is FetchJob.DONE:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield from item
+    finally:
+        job.cancel()
@@ -0,0 +1,84 @@
+"""
+Geometry codec between QGIS and the database. Geometries are exchanged as WKB buffers, without building
+GEOS geometries nor going through WKT:
+- reads select the geometry encoded as WKB by the database (`AsWKB`), and pass the cursor's buffer to
+  `QgsGeometry.fromWkb`
+- bulk writes pass the WKB of the QgsGeometry as a query parameter, decoded by the database with the
+  layer's SRID (`FromWKB`)
+
+GEOS geometries are only built for writes going through the model's `save()`, so that custom save logic
+gets regular geometry values.
+"""
+
+from django.contrib.gis.geos import GEOSGeometry
+from django.db.models import Func, Value
+from qgis.core import QgsGeometry
+
+
+class FromWKB(Func):
+    """
+    Geometry decoded by the database from a WKB parameter, with the given SRID
+    """
+
+    function = "ST_GeomFromWKB"
+
+    def __init__(self, wkb, srid, output_field):
+        super().__init__(Value(wkb), Value(srid), output_field=output_field)
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        return super().as_sql(
+            compiler, connection, function="GeomFromWKB", **extra_context
+        )
+
+    def as_oracle(self, compiler, connection, **extra_context):
+        return super().as_sql(
+            compiler, connection, function="SDO_GEOMETRY", **extra_context
+        )
+
+
+def wkb_bytes(wkb):
+    """
+    Returns the WKB value of a row as bytes (psycopg2 returns memoryviews, which QGIS doesn't accept)
+    """
+    if isinstance(wkb, memoryview):
+        return wkb.tobytes()
+    return wkb
+
+
+def wkb_to_qgs(wkb):
+    """
+    Returns the QgsGeometry of a WKB value (null geometry if None)
+    """
+    geometry = QgsGeometry()
+    if wkb is not None:
+        geometry.fromWkb(wkb_bytes(wkb))
+    return geometry
+
+
+def qgs_to_wkb(geometry):
+    """
+    Returns the WKB of a QgsGeometry as bytes, or None for null geometries
+    """
+    if geometry is None or geometry.isNull():
+        return None
+    return geometry.asWkb().data()
+
+
+def qgs_to_db(geometry, geom_field):
+    """
+    Returns an expression inserting the QgsGeometry in the geometry field's column, for bulk writes
+    """
+    wkb = qgs_to_wkb(geometry)
+    if wkb is None:
+        return None
+    return FromWKB(wkb, geom_field.srid, output_field=geom_field)
+
+
+def qgs_to_geos(geometry, srid):
+    """
+    Converts a QgsGeometry to a GEOSGeometry using WKB
+    """
+    wkb = qgs_to_wkb(geometry)
+    if wkb is None:
+        return None
+    return GEOSGeometry(memoryview(wkb), srid=srid)
@@ -0,0 +1,227 @@
+"""
+Hybrid provider, reading features through QGIS's native provider (`postgres` or `spatialite`) over the SQL
+generated by the ORM (so that inheritance and custom managers are taken into account), and writing them
+through Django (so that custom save logic and signals keep working).
+"""
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import F, Field, Func
+from qgis.core import (
+    QgsDataProvider,
+    QgsDataSourceUri,
+    QgsFeatureRequest,
+    QgsMessageLog,
+    QgsProviderRegistry,
+    QgsWkbTypes,
+)
+
+from . import HYBRID_PROVIDER_DESCRIPTION, HYBRID_PROVIDER_KEY
+from .exceptions import QDMTKException
+from .provider import Provider
+from .schema import get_schema
+
+# Prefix of the column aliases of the ORM query, renamed to the fields names by the wrapping query
+COLUMN_ALIAS = "qdmtk_c"
+
+# Alias of the fid column, when the pk isn't exposed as an attribute
+FID_ALIAS = "qdmtk_fid"
+
+
+class RawGeometry(Func):
+    """
+    Selects the geometry column as is. With a geometry output field, GeoDjango would cast it (e.g. to
+    `bytea` on PostGIS), which native providers can't read.
+    """
+
+    template = "%(expressions)s"
+
+    def __init__(self, expression):
+        super().__init__(expression, output_field=Field())
+
+
+def native_provider_key(alias):
+    """Returns the key of the native QGIS provider able to read the database"""
+    connection = connections[alias]
+    if connection.vendor == "postgresql":
+        return "postgres"
+    if connection.vendor == "sqlite" and getattr(connection.ops, "spatialite", False):
+        return "spatialite"
+    raise QDMTKException(f"No native provider for {connection.vendor} databases")
+
+
+def native_uri(model, alias, queryset=None, schema=None):
+    """
+    Returns the uri of a native layer reading the queryset (defaults to all the model's rows). Columns
+    are selected in the order of the layer schema (defaults to the model's), so that field indices match
+    the Django provider.
+    """
+    schema = get_schema(model) if schema is None else schema
+    queryset = model.objects.all() if queryset is None else queryset
+
+    columns = {
+        f"{COLUMN_ALIAS}{i}": F(attr.attname) for i, attr in enumerate(schema.attrs)
+    }
+    names = [attr.name for attr in schema.attrs]
+    for i, (name, expression) in enumerate(schema.computed, len(schema.attrs)):
+        columns[f"{COLUMN_ALIAS}{i}"] = expression
+        names.append(name)
+
+    # The pk is used as key column, which is the pk attribute (inherited from the parent with multi-table
+    # inheritance) or an additional column
+    pk = model._meta.pk
+    while pk.is_relation:
+        pk = pk.target_field
+    if pk.name in names:
+        key = pk.name
+    else:
+        key = FID_ALIAS
+        columns[FID_ALIAS] = F("pk")
+        names.append(FID_ALIAS)
+
+    geom_field = schema.geom_field
+    if geom_field is not None:
+        columns[f"{COLUMN_ALIAS}geom"] = RawGeometry(F(geom_field.name))
+        names.append(geom_field.name)
+
+    query = queryset.order_by().annotate(**columns).values_list(*columns)
+    sql = _compose_sql(alias, *query.query.sql_with_params())
+    quote = connections[alias].ops.quote_name
+    renames = ", ".join(
+        f"{quote(column)} AS {quote(name)}" for column, name in zip(columns, names)
+    )
+
+    db = settings.DATABASES[alias]
+    uri = QgsDataSourceUri()
+    if native_provider_key(alias) == "postgres":
+        uri.setConnection(
+            db.get("HOST", ""),
+            str(db.get("PORT", "")),
+            db["NAME"],
+            db.get("USER", ""),
+            db.get("PASSWORD", ""),
+        )
+    else:
+        uri.setDatabase(db["NAME"])
+    uri.setDataSource(
+        "",
+        f"(SELECT {renames} FROM ({sql}) AS qdmtk_query)",
+        geom_field.name if geom_field is not None else "",
+        "",
+        key,
+    )
+    uri.setUseEstimatedMetadata(True)
+    if geom_field is not None:
+        # Avoids the provider probing the geometry type and SRID with full scans
+        uri.setSrid(str(geom_field.srid))
+        uri.setWkbType(QgsWkbTypes.parseType(geom_field.geom_type))
+    else:
+        uri.setWkbType(QgsWkbTypes.NoGeometry)
+    return uri.uri(False)
+
+
+def _compose_sql(alias, sql, params):
+    """Returns the SQL with the params quoted by the database driver"""
+    if not params:
+        return sql
+    connection = connections[alias]
+    with connection.cursor() as cursor:
+        if connection.vendor == "postgresql":
+            sql = cursor.mogrify(sql, params)
+            return sql.decode() if isinstance(sql, bytes) else sql
+        # SQLite quotes the params with QUOTE(), in a single query
+        cursor.execute("SELECT " + ", ".join(["QUOTE(%s)"] * len(params)), list(params))
+        return sql % tuple(cursor.fetchone())
+
+
+class HybridProvider(Provider):
+    @classmethod
+    def providerKey(cls):
+        return HYBRID_PROVIDER_KEY
+
+    @classmethod
+    def description(cls):
+        return HYBRID_PROVIDER_DESCRIPTION
+
+    def __init__(
+        self,
+        uri="",
+        providerOptions=QgsDataProvider.ProviderOptions(),
+        flags=QgsDataProvider.ReadFlags(),
+    ):
+        super().__init__(uri, providerOptions, flags)
+        self._provider_options = providerOptions
+        self._native = self._create_native()
+
+    def _create_native(self):
+        native = QgsProviderRegistry.instance().createProvider(
+            native_provider_key(self._db),
+            native_uri(self.model, self._db, self._queryset(), self._schema),
+            self._provider_options,
+        )
+        if native is None or not native.isValid():
+            QgsMessageLog.logMessage(
+                f"Could not create the native provider for {self.model._meta.label}",
+                "QDMTK",
+            )
+        return native
+
+    # Reads are delegated to the native provider
+
+    def isValid(self):
+        return self._native is not None and self._native.isValid()
+
+    def featureSource(self):
+        return self._native.featureSource()
+
+    def getFeatures(self, request=QgsFeatureRequest()):
+        return self._native.getFeatures(request)
+
+    def fields(self):
+        return self._native.fields()
+
+    def featureCount(self):
+        return self._native.featureCount()
+
+    def extent(self):
+        return self._native.extent()
+
+    def updateExtents(self):
+        self._native.updateExtents()
+
+    def uniqueValues(self, fieldIndex, limit=-1):
+        return self._native.uniqueValues(fieldIndex, limit)
+
+    def uniqueStringsMatching(self, index, substring, limit=-1, feedback=None):
+        return self._native.uniqueStringsMatching(index, substring, limit, feedback)
+
+    def minimumValue(self, index):
+        return self._native.minimumValue(index)
+
+    def maximumValue(self, index):
+        return self._native.maximumValue(index)
+
+    def setSubsetString(self, subsetString, updateFeatureCount=True):
+        """
+        Subset strings are QGIS expressions translated to the ORM, as with the Django provider. Only
+        expressions that can be fully translated are supported.
+        """
+        previous = self._subset_string
+        if not super().setSubsetString(subsetString, updateFeatureCount):
+            return False
+        if not self._subset_complete:
+            QgsMessageLog.logMessage(
+                f"Subset string {subsetString} can't be fully translated to SQL, which is required by the hybrid provider",
+                "QDMTK",
+            )
+            super().setSubsetString(previous, updateFeatureCount)
+            return False
+        self._native = self._create_native()
+        self.dataChanged.emit()
+        return True
+
+    def _invalidate_cache(self, **kwargs):
+        super()._invalidate_cache(**kwargs)
+        # The native provider reads through its own connection, so it sees the edits once committed
+        self._native.reloadData()
+        transaction.on_commit(self._native.reloadData, using=self._db)
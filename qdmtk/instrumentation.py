@@ -0,0 +1,187 @@
+"""
+Opt-in instrumentation of the providers. When enabled (from the profiler dock, or with the
+`QDMTK_INSTRUMENTATION=1` env var), each feature request and provider call records its SQL queries count
+and time, the fetched rows, the time spent building model instances, decoding geometries and filling
+features, and the time to the first feature.
+
+Profiles are kept in memory (the last `MAX_PROFILES`) and can be summarized by layer or exported as JSON.
+"""
+
+import functools
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from django.db import connections
+
+# Number of profiles kept in memory
+MAX_PROFILES = 5000
+
+# Timings recorded by profiles, in seconds
+TIMINGS = ("total", "sql", "fetch", "instances", "geometry", "fill", "first_feature")
+
+_local = threading.local()
+
+
+class Profile:
+    def __init__(self, layer, kind, request=""):
+        self.layer = layer
+        self.kind = kind
+        self.request = request
+        self.started = time.time()
+        self.sql_count = 0
+        self.rows = 0
+        self.timings = dict.fromkeys(TIMINGS, 0.0)
+        self.timings["first_feature"] = None
+        self._start = time.perf_counter()
+
+    def add(self, timing, start):
+        """adds the time elapsed since `start` (a `time.perf_counter()` value) to the timing"""
+        self.timings[timing] += time.perf_counter() - start
+
+    def first_feature(self):
+        if self.timings["first_feature"] is None:
+            self.timings["first_feature"] = time.perf_counter() - self._start
+
+    def finish(self):
+        self.timings["total"] = time.perf_counter() - self._start
+
+    def as_dict(self):
+        return {
+            "layer": self.layer,
+            "kind": self.kind,
+            "request": self.request,
+            "started": self.started,
+            "sql_count": self.sql_count,
+            "rows": self.rows,
+            **{f"{name}_s": value for name, value in self.timings.items()},
+        }
+
+
+def _sql_wrapper(execute, sql, params, many, context):
+    """execute wrapper recording the queries in the active profile of the thread"""
+    profile = getattr(_local, "profile", None)
+    if profile is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        profile.sql_count += 1
+        profile.add("sql", start)
+
+
+class Recorder:
+    def __init__(self):
+        self.enabled = os.getenv("QDMTK_INSTRUMENTATION") == "1"
+        self.profiles = deque(maxlen=MAX_PROFILES)
+        self._lock = threading.Lock()
+
+    def start(self, provider, kind, request=""):
+        """Returns a new profile for the provider, or None if instrumentation is disabled"""
+        if not self.enabled:
+            return None
+        return Profile(provider.dataSourceUri(), kind, request)
+
+    def finish(self, profile):
+        profile.finish()
+        with self._lock:
+            self.profiles.append(profile)
+
+    @contextmanager
+    def active(self, profile, alias):
+        """Records the queries run on the database by the current thread in the profile"""
+        connection = connections[alias]
+        if _sql_wrapper not in connection.execute_wrappers:
+            connection.execute_wrappers.append(_sql_wrapper)
+        previous = getattr(_local, "profile", None)
+        _local.profile = profile
+        try:
+            yield profile
+        finally:
+            _local.profile = previous
+
+    def clear(self):
+        with self._lock:
+            self.profiles.clear()
+
+    def snapshot(self):
+        with self._lock:
+            return [profile.as_dict() for profile in self.profiles]
+
+    def summary(self):
+        """
+        Returns the totals by layer and kind of profile. `first_feature_s` only sums the profiles which
+        produced a feature, counted by `first_feature_count`.
+        """
+        totals = {}
+        for profile in self.snapshot():
+            key = (profile["layer"], profile["kind"])
+            total = totals.setdefault(
+                key,
+                {
+                    "layer": profile["layer"],
+                    "kind": profile["kind"],
+                    "count": 0,
+                    "sql_count": 0,
+                    "rows": 0,
+                    "first_feature_count": 0,
+                    **{f"{name}_s": 0.0 for name in TIMINGS},
+                },
+            )
+            total["count"] += 1
+            total["sql_count"] += profile["sql_count"]
+            total["rows"] += profile["rows"]
+            total["first_feature_count"] += profile["first_feature_s"] is not None
+            for name in TIMINGS:
+                total[f"{name}_s"] += profile[f"{name}_s"] or 0.0
+        return list(totals.values())
+
+    def export(self, path):
+        with open(path, "w") as f:
+            json.dump(
+                {"summary": self.summary(), "profiles": self.snapshot()}, f, indent=2
+            )
+
+
+# Recorder shared by all layers
+recorder = Recorder()
+
+
+@contextmanager
+def timing(name):
+    """Adds the time spent in the block to the timing of the thread's active profile, if any"""
+    profile = getattr(_local, "profile", None)
+    if profile is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.add(name, start)
+
+
+def profiled(kind):
+    """
+    Decorates a provider method so that it's recorded when instrumentation is enabled
+    """
+
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(provider, *args, **kwargs):
+            profile = recorder.start(provider, kind)
+            if profile is None:
+                return method(provider, *args, **kwargs)
+            try:
+                with recorder.active(profile, provider._db):
+                    return method(provider, *args, **kwargs)
+            finally:
+                recorder.finish(profile)
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,95 @@
+"""
+Estimated feature counts and extents, read from the database statistics instead of scanning the tables, for
+layers using the `estimated_metadata` option. Functions return None when no estimate is available (other
+backends, or statistics not computed yet), in which case the exact values are computed.
+"""
+
+from django.db import DatabaseError, connections, transaction
+from qgis.core import QgsMessageLog, QgsRectangle
+
+
+def estimated_count(alias, model, geom_field):
+    """
+    Returns the estimated number of rows of the model's table, from `pg_class.reltuples` on Postgres
+    (updated by ANALYZE and autovacuum) or from `geometry_columns_statistics` on Spatialite (updated by
+    `UpdateLayerStatistics()`)
+    """
+    connection = connections[alias]
+    table = model._meta.db_table
+    if connection.vendor == "postgresql":
+        row = _fetch_one(
+            alias,
+            "SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(%s)",
+            [connection.ops.quote_name(table)],
+        )
+        # reltuples is -1 (or 0 on Postgres < 14) for tables that were never analyzed
+        if row is None or row[0] is None or row[0] <= 0:
+            return None
+        return row[0]
+    if _is_spatialite(connection) and geom_field is not None:
+        # Statistics are kept per geometry column, so this only works for the table holding the geometry
+        if geom_field.model._meta.db_table != table:
+            return None
+        row = _spatialite_statistics(alias, table, geom_field.column)
+        return row[0] if row is not None else None
+    return None
+
+
+def estimated_extent(alias, model, geom_field):
+    """
+    Returns the estimated extent of the geometry column as a QgsRectangle, from `ST_EstimatedExtent` on
+    Postgres or from `geometry_columns_statistics` on Spatialite
+    """
+    if geom_field is None:
+        return None
+    connection = connections[alias]
+    # With multi-table inheritance, this is the extent of the parent table holding the geometry
+    table = geom_field.model._meta.db_table
+    if connection.vendor == "postgresql":
+        row = _fetch_one(
+            alias,
+            "SELECT ST_XMin(e), ST_YMin(e), ST_XMax(e), ST_YMax(e) "
+            "FROM ST_EstimatedExtent(%s, %s) AS e",
+            [table, geom_field.column],
+        )
+        values = row
+    elif _is_spatialite(connection):
+        row = _spatialite_statistics(alias, table, geom_field.column)
+        values = row[1:] if row is not None else None
+    else:
+        return None
+    if values is None or any(v is None for v in values):
+        return None
+    return QgsRectangle(*values)
+
+
+def _is_spatialite(connection):
+    return connection.vendor == "sqlite" and getattr(
+        connection.ops, "spatialite", False
+    )
+
+
+def _spatialite_statistics(alias, table, column):
+    """returns the `(row_count, min_x, min_y, max_x, max_y)` statistics of a geometry column"""
+    row = _fetch_one(
+        alias,
+        "SELECT row_count, extent_min_x, extent_min_y, extent_max_x, extent_max_y "
+        "FROM geometry_columns_statistics "
+        "WHERE lower(f_table_name) = lower(%s) AND lower(f_geometry_column) = lower(%s)",
+        [table, column],
+    )
+    if row is None or row[0] is None:
+        return None
+    return row
+
+
+def _fetch_one(alias, sql, params):
+    """runs the query in a savepoint, so that a failure doesn't break an ongoing transaction"""
+    try:
+        with transaction.atomic(using=alias):
+            with connections[alias].cursor() as cursor:
+                cursor.execute(sql, params)
+                return cursor.fetchone()
+    except DatabaseError as e:
+        QgsMessageLog.logMessage(f"Could not read estimated metadata ({e})", "QDMTK")
+        return None
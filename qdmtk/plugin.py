@@ -1,32 +1,59 @@
 import os.path
+import sys
 from io import StringIO
 
-import django
-from django.apps import apps
-from django.conf import settings
-from django.core.management import call_command
-from django.db.utils import OperationalError
 from qgis.core import (
     Qgis,
-    QgsCoordinateReferenceSystem,
-    QgsDataSourceUri,
+    QgsDataProvider,
     QgsMessageLog,
     QgsProject,
     QgsProviderMetadata,
     QgsProviderRegistry,
     QgsVectorLayer,
 )
+from qgis.PyQt.QtCore import Qt
 from qgis.PyQt.QtGui import QIcon
 from qgis.PyQt.QtWidgets import QAction, QMessageBox
 
-from . import datamodels_registry, prepare_django, register_datamodel
+from . import (
+    HYBRID_PROVIDER_DESCRIPTION,
+    HYBRID_PROVIDER_KEY,
+    PROVIDER_DESCRIPTION,
+    PROVIDER_KEY,
+    datamodels_registry,
+    prepare_django,
+    register_datamodel,
+)
 from .contrib.demo_models import config
-from .provider import Provider
-from .utils import find_geom_field, find_pk_field
+
+# NOTE : Django (and everything depending on it) is only imported and set up when first needed (when a
+# layer using the Django provider is created or an action is run), so that it doesn't slow down QGIS startup.
 
 QgsMessageLog.logMessage("loading qdmtk file", "QDMTK")
 
 
+def create_provider(uri, providerOptions, flags=QgsDataProvider.ReadFlags()):
+    """
+    Sets up Django on first use and creates the provider
+    """
+    prepare_django()
+
+    from .provider import Provider
+
+    return Provider.createProvider(uri, providerOptions, flags)
+
+
+def create_hybrid_provider(uri, providerOptions, flags=QgsDataProvider.ReadFlags()):
+    """
+    Sets up Django on first use and creates the hybrid provider
+    """
+    prepare_django()
+
+    from .hybrid import HybridProvider
+
+    return HybridProvider.createProvider(uri, providerOptions, flags)
+
+
 class Plugin:
     """QGIS Plugin Implementation."""
 
@@ -38,16 +65,21 @@ class Plugin:
         register_datamodel(config.PROJECTNAME_A, config.APPS_A, config.DATABASE_A)
         register_datamodel(config.PROJECTNAME_B, config.APPS_B, config.DATABASE_B)
 
-        iface.initializationCompleted.connect(prepare_django)
-
     def initGui(self):
         """Create the menu entries and toolbar icons inside the QGIS GUI."""
 
         # Register our provider
         metadata = QgsProviderMetadata(
-            Provider.providerKey(), Provider.description(), Provider.createProvider
+            PROVIDER_KEY, PROVIDER_DESCRIPTION, create_provider
         )
         QgsProviderRegistry.instance().registerProvider(metadata)
+        hybrid_metadata = QgsProviderMetadata(
+            HYBRID_PROVIDER_KEY, HYBRID_PROVIDER_DESCRIPTION, create_hybrid_provider
+        )
+        QgsProviderRegistry.instance().registerProvider(hybrid_metadata)
+
+        # Group the commits of Django layers in edit sessions
+        QgsProject.instance().layersAdded.connect(self.watch_layers)
 
         # Add toolbar
         self.toolbar = self.iface.addToolBar("Datamodel")
@@ -68,6 +100,14 @@ class Plugin:
         self.load_layers_pg_action.triggered.connect(self.load_layers_pg)
         self.toolbar.addAction(self.load_layers_pg_action)
 
+        self.load_layers_hybrid_action = QAction(
+            QIcon(os.path.join(self.plugin_dir, "icon.svg")),
+            "Load datamodel layers (using hybrid provider)",
+            self.toolbar,
+        )
+        self.load_layers_hybrid_action.triggered.connect(self.load_layers_hybrid)
+        self.toolbar.addAction(self.load_layers_hybrid_action)
+
         self.migrate_action = QAction("Migrate", self.toolbar)
         self.migrate_action.triggered.connect(self.migrate)
         self.toolbar.addAction(self.migrate_action)
@@ -76,6 +116,12 @@ class Plugin:
         self.showmigrations_action.triggered.connect(self.showmigrations)
         self.toolbar.addAction(self.showmigrations_action)
 
+        self.profiler_dock = None
+        self.profiler_action = QAction("Profiler", self.toolbar)
+        self.profiler_action.setCheckable(True)
+        self.profiler_action.toggled.connect(self.toggle_profiler)
+        self.toolbar.addAction(self.profiler_action)
+
         # Uncomment this to load the demo datamodel
         # from . import register_datamodel
         # from .qdmtkdemo import config
@@ -83,10 +129,57 @@ class Plugin:
 
     def unload(self):
         self.iface.mainWindow().removeToolBar(self.toolbar)
+        if self.profiler_dock is not None:
+            self.iface.removeDockWidget(self.profiler_dock)
+            self.profiler_dock.deleteLater()
+        QgsProject.instance().layersAdded.disconnect(self.watch_layers)
+        # Stop the background fetch workers, if they were started
+        fetcher = sys.modules.get(f"{__package__}.fetcher")
+        if fetcher is not None:
+            fetcher.shutdown()
         # seems this does not exist ? can we still autoreload
         # QgsProviderRegistry.instance().unregisterProvider(Provider.providerKey())
 
+    def watch_layers(self, layers):
+        layers = [
+            layer
+            for layer in layers
+            if layer.providerType() in (PROVIDER_KEY, HYBRID_PROVIDER_KEY)
+        ]
+        if not layers:
+            # Django is only imported by projects with QDMTK layers
+            return
+
+        from django.db import router
+
+        from .router import find_model
+        from .transactions import watch_layer
+        from .utils import parse_uri
+
+        for layer in layers:
+            model_name, _ = parse_uri(layer.source())
+            watch_layer(layer, router.db_for_write(find_model(model_name)))
+
+    def toggle_profiler(self, checked):
+        if self.profiler_dock is None:
+            from .profiler_dock import ProfilerDock
+
+            self.profiler_dock = ProfilerDock(self.iface.mainWindow())
+            self.profiler_dock.visibilityChanged.connect(
+                self.profiler_action.setChecked
+            )
+            self.iface.addDockWidget(Qt.BottomDockWidgetArea, self.profiler_dock)
+        self.profiler_dock.setVisible(checked)
+
     def migrate(self):
+        prepare_django()
+
+        from django.apps import apps
+        from django.core.management import call_command
+        from django.db.utils import OperationalError
+
+        from .pool import pooled
+
         apps_names = {app.name: app.label for app in apps.get_app_configs()}
 
         out = StringIO()
@@ -101,13 +194,14 @@ class Plugin:
                     f"Will migrate {app_to_migrate} to {datamodel_key}", "QDMTK"
                 )
                 try:
-                    call_command(
-                        "migrate",
-                        app_to_migrate,
-                        "--database",
-                        datamodel_key,
-                        stdout=out,
-                    )
+                    with pooled(datamodel_key):
+                        call_command(
+                            "migrate",
+                            app_to_migrate,
+                            "--database",
+                            datamodel_key,
+                            stdout=out,
+                        )
                 except OperationalError as e:
                     out.write(f"Could not connect ({e})\n")
                 out.flush()
@@ -116,6 +210,14 @@ class Plugin:
         )
 
     def showmigrations(self):
+        prepare_django()
+
+        from django.apps import apps
+        from django.core.management import call_command
+        from django.db.utils import OperationalError
+
+        from .pool import pooled
+
         apps_names = {app.name: app.label for app in apps.get_app_configs()}
         out = StringIO()
         for datamodel_key, datamodel_opts in datamodels_registry.items():
@@ -124,13 +226,14 @@ class Plugin:
             ]
             out.write(f"--- {datamodel_key} ---\n")
             try:
-                call_command(
-                    "showmigrations",
-                    *apps_to_migrate,
-                    "--database",
-                    datamodel_key,
-                    stdout=out,
-                )
+                with pooled(datamodel_key):
+                    call_command(
+                        "showmigrations",
+                        *apps_to_migrate,
+                        "--database",
+                        datamodel_key,
+                        stdout=out,
+                    )
             except OperationalError as e:
                 out.write(f"Could not connect ({e})\n")
             out.flush()
@@ -139,12 +242,20 @@ class Plugin:
         )
 
     def load_layers_dj(self, checked):
-        for model in django.apps.apps.get_models():
+        self._load_layers(PROVIDER_KEY)
+
+    def load_layers_hybrid(self, checked):
+        self._load_layers(HYBRID_PROVIDER_KEY)
+
+    def _load_layers(self, provider_key):
+        prepare_django()
+
+        from django.apps import apps
+
+        for model in apps.get_models():
             if not getattr(model, "qdmtk_addlayer", False):
                 continue
-            layer = QgsVectorLayer(
-                model.__name__, model.__name__, Provider.providerKey()
-            )
+            layer = QgsVectorLayer(model._meta.label, model.__name__, provider_key)
             QgsProject.instance().addMapLayer(layer)
 
         self.iface.messageBar().pushMessage(
@@ -152,47 +263,20 @@ class Plugin:
         )
 
     def load_layers_pg(self, checked):
-        for model in django.apps.apps.get_models():
+        prepare_django()
+
+        from django.apps import apps
+        from django.db import router
+
+        from .hybrid import native_provider_key, native_uri
+
+        for model in apps.get_models():
             if not getattr(model, "qdmtk_addlayer", False):
                 continue
-            db = settings.DATABASES["default"]
-            uri = QgsDataSourceUri()
-            uri.setConnection(
-                db["HOST"], db["PORT"], db["NAME"], db["USER"], db["PASSWORD"]
-            )
-            query = f"({model.objects.all().query})"
-            geom_field = find_geom_field(model)
-            geom_field.srid if geom_field else None
-            key_field = getattr(find_pk_field(model), "name", None)
-            uri.setDataSource(
-                None,
-                query,
-                geom_field.name if geom_field else None,
-                aKeyColumn=key_field,
-            )
-            uri.setUseEstimatedMetadata(True)
-            if geom_field:
-                uri.setSrid(str(geom_field.srid))
-            layer = QgsVectorLayer(uri.uri(), model.__name__, "postgres")
-            if geom_field:
-                crs = QgsCoordinateReferenceSystem()
-                crs.createFromString(f"POSTGIS:{geom_field.srid}")
-                layer.setCrs(crs)
-
-            # Loading a postgres current doesn't work because of `ERROR: function st_srid(bytea) is not unique`
-            # when loaded in QGIS. Seems to happen on layer loading when SRID is unknown, due to some ambigous
-            # type casts made by geodjango.
-            # See https://github.com/qgis/QGIS/blob/082aa7bbcb847b9ed507e808203bb23c979c4c45/src/providers/postgres/qgspostgresconn.cpp#L1966-L1972
-            # Suprisingly, setting the CRS as done above is not enough and this code still runs.
-            # We work-around this by monkey-patching the cast, but that breaks django' provider :-/
-            # TODO : find a fix to remove this monkey patch (either upstream in geodjango to have a better cast,
-            # or in QGIS to avoid this query being run)
-            from django.contrib.gis.db.backends.postgis.operations import (
-                PostGISOperations,
+            alias = router.db_for_read(model)
+            layer = QgsVectorLayer(
+                native_uri(model, alias), model.__name__, native_provider_key(alias)
             )
-
-            PostGISOperations.select = "%s::geometry"
-
             QgsProject.instance().addMapLayer(layer)
 
         self.iface.messageBar().pushMessage(
@@ -0,0 +1,177 @@
+"""
+Connections of the datamodels' databases.
+
+Django connections are thread-local. They are made persistent (`CONN_MAX_AGE`, with health checks), so that
+the main thread and the background fetch workers reuse them instead of reconnecting for each query, and the
+number of connections used concurrently per database is bounded by the datamodel's pool size (`POOL_SIZE`
+in the database settings). Provider reads and edits, background fetches and migrations all go through the
+pool. Statistics about opened and reused connections and about waits are collected.
+
+Health checks (`CONN_HEALTH_CHECKS`) require Django 4.1, older versions only close obsolete connections.
+"""
+
+import functools
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from ctypes.util import find_library
+
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+from .exceptions import QDMTKException
+
+# Seconds a connection stays open, if not set in the database settings
+DEFAULT_CONN_MAX_AGE = 600
+
+# Number of connections used concurrently per database, if not set in the database settings
+DEFAULT_POOL_SIZE = 4
+
+# Seconds to wait for a connection before failing, if not set in the database settings
+DEFAULT_POOL_TIMEOUT = 60
+
+# Candidate names of the Spatialite extension (as tried by Django)
+SPATIALITE_LIBRARIES = ["mod_spatialite.so", "mod_spatialite", "mod_spatialite.dll"]
+
+_lock = threading.Lock()
+_local = threading.local()
+_semaphores = {}
+_stats = defaultdict(
+    lambda: {"opened": 0, "reused": 0, "acquired": 0, "wait_time": 0.0, "max_wait": 0.0}
+)
+
+
+def configure_database(db_settings):
+    """
+    Returns the database settings with persistent connections and health checks enabled by default
+    """
+    db_settings = dict(db_settings)
+    db_settings.setdefault("CONN_MAX_AGE", DEFAULT_CONN_MAX_AGE)
+    db_settings.setdefault("CONN_HEALTH_CHECKS", True)
+    return db_settings
+
+
+def find_spatialite_library():
+    """
+    Returns the first Spatialite extension that can be loaded, so that new connections load it directly
+    instead of trying each candidate
+    """
+    candidates = list(SPATIALITE_LIBRARIES)
+    found = find_library("spatialite")
+    if found:
+        candidates.append(found)
+    for candidate in candidates:
+        conn = sqlite3.connect(":memory:")
+        try:
+            conn.enable_load_extension(True)
+            conn.load_extension(candidate)
+            return candidate
+        except (AttributeError, sqlite3.Error):
+            continue
+        finally:
+            conn.close()
+    return None
+
+
+def _count_opened(sender, connection, **kwargs):
+    with _lock:
+        _stats[connection.alias]["opened"] += 1
+
+
+def watch_connections():
+    """Counts the opened connections (called by `prepare_django()`)"""
+    connection_created.connect(_count_opened, dispatch_uid="qdmtk_pool_opened")
+
+
+def _semaphore(alias):
+    with _lock:
+        semaphore = _semaphores.get(alias)
+        if semaphore is None:
+            size = connections[alias].settings_dict.get("POOL_SIZE", DEFAULT_POOL_SIZE)
+            semaphore = _semaphores[alias] = threading.BoundedSemaphore(size)
+        return semaphore
+
+
+class PoolTimeout(QDMTKException):
+    pass
+
+
+def _held():
+    """Returns the number of nested `pooled()` blocks of the current thread by alias"""
+    if not hasattr(_local, "held"):
+        _local.held = defaultdict(int)
+    return _local.held
+
+
+def _check_connection(connection):
+    """Closes the connection if it's obsolete or unusable, unless it's in a transaction"""
+    if not connection.in_atomic_block:
+        connection.close_if_unusable_or_obsolete()
+
+
+@contextmanager
+def pooled(alias):
+    """
+    Uses the database's connection of the current thread, waiting if the pool size is reached (raising
+    PoolTimeout after the database's `POOL_TIMEOUT`). The
+    connection is closed afterwards if it's obsolete or unusable. Nested blocks of a thread (e.g. several
+    open feature iterators) share its connection and slot.
+    """
+    held = _held()
+    connection = connections[alias]
+    if not held[alias]:
+        semaphore = _semaphore(alias)
+        timeout = connection.settings_dict.get("POOL_TIMEOUT", DEFAULT_POOL_TIMEOUT)
+        start = time.monotonic()
+        if not semaphore.acquire(timeout=timeout):
+            raise PoolTimeout(f"No connection to {alias} available after {timeout}s")
+        wait = time.monotonic() - start
+        try:
+            _check_connection(connection)
+        except BaseException:
+            semaphore.release()
+            raise
+        with _lock:
+            stats = _stats[alias]
+            stats["acquired"] += 1
+            stats["reused"] += connection.connection is not None
+            stats["wait_time"] += wait
+            stats["max_wait"] = max(stats["max_wait"], wait)
+    held[alias] += 1
+    try:
+        yield connection
+    finally:
+        # blocks may exit out of order (e.g. generators closed after a later one), the slot is released
+        # by the last one
+        held[alias] -= 1
+        if not held[alias]:
+            try:
+                _check_connection(connection)
+            finally:
+                _semaphore(alias).release()
+
+
+def holds(alias):
+    """Whether the current thread is in a `pooled()` block of the database"""
+    return _held()[alias] > 0
+
+
+def pooled_method(method):
+    """
+    Decorates a provider method so that it runs with a pooled connection of the provider's database
+    """
+
+    @functools.wraps(method)
+    def wrapper(provider, *args, **kwargs):
+        with pooled(provider._db):
+            return method(provider, *args, **kwargs)
+
+    return wrapper
+
+
+def stats():
+    """Returns the connections statistics by database alias"""
+    with _lock:
+        return {alias: dict(values) for alias, values in _stats.items()}
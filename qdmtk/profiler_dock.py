@@ -0,0 +1,113 @@
+"""
+Dock panel showing the instrumentation of the providers, summarized by layer and kind of call
+"""
+
+from qgis.PyQt.QtCore import Qt, QTimer
+from qgis.PyQt.QtWidgets import (
+    QCheckBox,
+    QDockWidget,
+    QFileDialog,
+    QHBoxLayout,
+    QPushButton,
+    QTableWidget,
+    QTableWidgetItem,
+    QVBoxLayout,
+    QWidget,
+)
+
+from .instrumentation import recorder
+
+# Refresh interval of the table, in milliseconds
+REFRESH_INTERVAL = 1000
+
+# (header, summary key, whether the value is a time in seconds shown in milliseconds)
+COLUMNS = [
+    ("Layer", "layer", False),
+    ("Kind", "kind", False),
+    ("Count", "count", False),
+    ("Total (ms)", "total_s", True),
+    ("SQL queries", "sql_count", False),
+    ("SQL (ms)", "sql_s", True),
+    ("Fetch (ms)", "fetch_s", True),
+    ("Rows", "rows", False),
+    ("Instances (ms)", "instances_s", True),
+    ("Geometry (ms)", "geometry_s", True),
+    ("Fill (ms)", "fill_s", True),
+    ("Avg first feature (ms)", "first_feature_s", True),
+]
+
+
+class ProfilerDock(QDockWidget):
+    def __init__(self, parent=None):
+        super().__init__("QDMTK profiler", parent)
+        self.setObjectName("QDMTKProfilerDock")
+
+        self.record_checkbox = QCheckBox("Record")
+        self.record_checkbox.setChecked(recorder.enabled)
+        self.record_checkbox.toggled.connect(self.set_recording)
+        clear_button = QPushButton("Clear")
+        clear_button.clicked.connect(self.clear)
+        export_button = QPushButton("Export JSON…")
+        export_button.clicked.connect(self.export)
+
+        buttons = QHBoxLayout()
+        buttons.addWidget(self.record_checkbox)
+        buttons.addStretch()
+        buttons.addWidget(clear_button)
+        buttons.addWidget(export_button)
+
+        self.table = QTableWidget(0, len(COLUMNS))
+        self.table.setHorizontalHeaderLabels([header for header, _, _ in COLUMNS])
+        self.table.setSortingEnabled(True)
+        self.table.setEditTriggers(QTableWidget.NoEditTriggers)
+
+        layout = QVBoxLayout()
+        layout.addLayout(buttons)
+        layout.addWidget(self.table)
+        widget = QWidget()
+        widget.setLayout(layout)
+        self.setWidget(widget)
+
+        self.timer = QTimer(self)
+        self.timer.setInterval(REFRESH_INTERVAL)
+        self.timer.timeout.connect(self.refresh)
+        self.visibilityChanged.connect(self.on_visibility_changed)
+
+    def set_recording(self, enabled):
+        recorder.enabled = enabled
+
+    def on_visibility_changed(self, visible):
+        if visible:
+            self.refresh()
+            self.timer.start()
+        else:
+            self.timer.stop()
+
+    def refresh(self):
+        summary = recorder.summary()
+        self.table.setSortingEnabled(False)
+        self.table.setRowCount(len(summary))
+        for row, total in enumerate(summary):
+            for column, (_, key, is_time) in enumerate(COLUMNS):
+                value = total[key]
+                if key == "first_feature_s":
+                    # averaged over the profiles which produced a feature
+                    count = total["first_feature_count"]
+                    value = value / count if count else 0.0
+                item = QTableWidgetItem()
+                item.setData(
+                    Qt.DisplayRole, round(value * 1000, 1) if is_time else value
+                )
+                self.table.setItem(row, column, item)
+        self.table.setSortingEnabled(True)
+
+    def clear(self):
+        recorder.clear()
+        self.refresh()
+
+    def export(self):
+        path, _ = QFileDialog.getSaveFileName(
+            self, "Export profiles", "qdmtk_profiles.json", "JSON (*.json)"
+        )
+        if path:
+            recorder.export(path)
@@ -3,20 +3,29 @@ Adapted from example in https://github.com/qgis/QGIS/blob/master/tests/src/pytho
 
 """
 
-import django
-import django.conf
+import time
+from collections import defaultdict
+
 from django.contrib.gis.db import models
 from django.contrib.gis.db.models import Extent
-from django.contrib.gis.geos import GEOSGeometry
+from django.contrib.gis.db.models.functions import AsWKB
+from django.contrib.gis.geos import Polygon
+from django.db import connections, router, transaction
+from django.db.models import Max, Min
+from django.db.models.expressions import RawSQL
 from qgis.core import (
     NULL,
     QgsAbstractFeatureIterator,
     QgsAbstractFeatureSource,
     QgsCoordinateReferenceSystem,
+    QgsCoordinateTransform,
+    QgsCsException,
     QgsDataProvider,
+    QgsExpression,
+    QgsExpressionContext,
+    QgsExpressionContextUtils,
     QgsFeatureIterator,
     QgsFeatureRequest,
-    QgsField,
     QgsFields,
     QgsGeometry,
     QgsMessageLog,
@@ -26,7 +35,41 @@ from qgis.core import (
 )
 from qgis.PyQt.QtCore import QVariant
 
-from .utils import find_geom_field, string_to_fid
+from . import PROVIDER_DESCRIPTION, PROVIDER_KEY
+from .cache import cache_key, feature_cache, row_size, tiles
+from .expressions import ExpressionCompiler
+from .fetcher import fetch_rows
+from .geometry import qgs_to_db, qgs_to_geos, wkb_to_qgs
+from .instrumentation import profiled, recorder, timing
+from .metadata import estimated_count, estimated_extent
+from .pool import holds, pooled, pooled_method
+from .router import find_model
+from .schema import get_schema
+from .transactions import mark_failed
+from .utils import (
+    chunked,
+    fids_chunk_size,
+    parse_bool,
+    parse_uri,
+    stream_rows,
+    string_to_fid,
+    supports_bulk_writes,
+)
+
+# Name of the annotation holding the WKB encoded geometry in read queries
+WKB_ANNOTATION = "qdmtk_wkb"
+
+# Default number of rows fetched per database roundtrip when streaming features
+DEFAULT_CHUNK_SIZE = 2000
+
+# Default number of rows written per query by bulk edits
+DEFAULT_BATCH_SIZE = 1000
+
+# Rowids whose bounding box intersects a rect, using Spatialite's R-tree
+SPATIALITE_INDEX_SQL = (
+    "SELECT rowid FROM SpatialIndex WHERE f_table_name = %s AND f_geometry_column = %s "
+    "AND search_frame = BuildMbr(%s, %s, %s, %s)"
+)
 
 
 class FeatureIterator(QgsAbstractFeatureIterator):
@@ -34,35 +77,139 @@ class FeatureIterator(QgsAbstractFeatureIterator):
         super().__init__(request)
         self.request = request
         self.source = source
+        self.iterator = None
+        self._filter_compiled = False
+
+        # Features are returned in the request's destination CRS, and the filter rect is in that CRS
+        self._transform = QgsCoordinateTransform()
+        if (
+            request.destinationCrs().isValid()
+            and request.destinationCrs() != source.crs
+        ):
+            self._transform = QgsCoordinateTransform(
+                source.crs, request.destinationCrs(), request.transformContext()
+            )
+        try:
+            self._filter_rect = self.filterRectToSourceCrs(self._transform)
+        except QgsCsException:
+            # the rect can't be transformed to the layer's CRS, so no feature is returned
+            self._filter_rect = None
+        self._exact_intersect = bool(request.flags() & QgsFeatureRequest.ExactIntersect)
+
+        # Parts of the subset string that couldn't be translated to the ORM are evaluated client-side
+        self._subset_expression = None
+        if not source.subset_complete:
+            self._expression_context = QgsExpressionContext()
+            self._expression_context.appendScope(
+                QgsExpressionContextUtils.globalScope()
+            )
+            self._expression_context.setFields(source.fields)
+            self._subset_expression = QgsExpression(source.subset_string)
+            self._subset_expression.prepare(self._expression_context)
+
+        # Instrumentation of the request (None unless enabled)
+        self._profile = recorder.start(
+            source.provider, "features", self._describe_request()
+        )
 
         self.rewind()
 
+    def _describe_request(self):
+        parts = [
+            {
+                QgsFeatureRequest.FilterType.FilterNone: "all",
+                QgsFeatureRequest.FilterType.FilterFid: "fid",
+                QgsFeatureRequest.FilterType.FilterFids: "fids",
+                QgsFeatureRequest.FilterType.FilterExpression: "expression",
+            }.get(self.request.filterType(), "other")
+        ]
+        if not self.request.filterRect().isNull():
+            parts.append("rect")
+        if self.request.flags() & QgsFeatureRequest.NoGeometry:
+            parts.append("no geometry")
+        if self.request.flags() & QgsFeatureRequest.SubsetOfAttributes:
+            parts.append("subset of attributes")
+        if self.request.orderBy():
+            parts.append("order by")
+        if self.request.limit() >= 0:
+            parts.append(f"limit {self.request.limit()}")
+        return ", ".join(parts)
+
     def fetchFeature(self, f):
         """fetch next feature, return true on success"""
-        try:
-            row = next(self.iterator)
-
-            # Geometry
-            geom = QgsGeometry()
-            row_geom = getattr(row, self.source.provider._geom_field.name)
-            if row_geom is not None:
-                geom.fromWkb(row_geom.wkb.tobytes())
-            f.setGeometry(geom)
-            # self.geometryToDestinationCrs(f, self._transform)
-
-            # Fields
-            f.setFields(self.source.provider.fields())
-            for attr in self.source.provider._attrs():
-                f.setAttribute(attr.name, getattr(row, attr.name))
-
-            f.setValid(True)
-            id = string_to_fid(row.id) if isinstance(row.id, str) else row.id
-            if id is not None:
-                f.setId(id)
+        if self._profile is not None:
+            return self._fetch_feature_profiled(f)
+        for row in self.iterator:
+            self._fill_feature(f, row)
+            if self._subset_expression is not None:
+                self._expression_context.setFeature(f)
+                if not self._subset_expression.evaluate(self._expression_context):
+                    continue
+            self.geometryToDestinationCrs(f, self._transform)
             return True
-        except StopIteration:
-            f.setValid(False)
-            return False
+        f.setValid(False)
+        return False
+
+    def _fetch_feature_profiled(self, f):
+        """same as fetchFeature, recording the queries and timings in the profile"""
+        profile = self._profile
+        with recorder.active(profile, self.source.provider._db):
+            while True:
+                start = time.perf_counter()
+                row = next(self.iterator, None)
+                profile.add("fetch", start)
+                if row is None:
+                    break
+                profile.rows += 1
+                start = time.perf_counter()
+                self._fill_geometry(f, row)
+                profile.add("geometry", start)
+                start = time.perf_counter()
+                self._fill_attributes(f, row)
+                profile.add("fill", start)
+                if self._subset_expression is not None:
+                    self._expression_context.setFeature(f)
+                    if not self._subset_expression.evaluate(self._expression_context):
+                        continue
+                self.geometryToDestinationCrs(f, self._transform)
+                profile.first_feature()
+                return True
+        f.setValid(False)
+        return False
+
+    def nextFeatureFilterFids(self, f):
+        """skips the client-side check of fids, as only requested fids are fetched"""
+        return self.fetchFeature(f)
+
+    def nextFeatureFilterExpression(self, f):
+        """skips the client-side evaluation of filter expressions fully translated to the ORM"""
+        if self._filter_compiled:
+            return self.fetchFeature(f)
+        return super().nextFeatureFilterExpression(f)
+
+    def _fill_feature(self, f, row):
+        """fills the feature from a row of the values query"""
+        self._fill_geometry(f, row)
+        self._fill_attributes(f, row)
+
+    def _fill_geometry(self, f, row):
+        if self._geom_column is not None:
+            f.setGeometry(wkb_to_qgs(row[self._geom_column]))
+        else:
+            f.setGeometry(QgsGeometry())
+
+    def _fill_attributes(self, f, row):
+        f.setFields(self.source.fields, True)
+        attributes = f.attributes()
+        for column, index in self._attrs_plan:
+            attributes[index] = row[column]
+        f.setAttributes(attributes)
+
+        f.setValid(True)
+        id = row[0]
+        id = string_to_fid(id) if isinstance(id, str) else id
+        if id is not None:
+            f.setId(id)
 
     def __iter__(self):
         """Returns self as an iterator object"""
@@ -75,35 +222,322 @@ class FeatureIterator(QgsAbstractFeatureIterator):
     def rewind(self):
         """reset the iterator to the starting position"""
 
-        query = self.source.provider.model.objects
+        query = self.source.queryset
+
+        filter_rect = self._filter_rect
+        if filter_rect is None:
+            self._close_iterator()
+            self.iterator = iter(())
+            return True
+
+        if self._cacheable():
+            # Rows are read from the cached blocks (with all columns, as blocks are shared by all requests)
+            self._close_iterator()
+            self.iterator = self._iter_cached(
+                self._prepare_values(query, all_columns=True), filter_rect
+            )
+            return True
 
-        filter_rect = self.request.filterRect()
-        if not filter_rect.isNull():
-            # TODO : probably need to transform rect CRS if needed like this
-            # transform = QgsCoordinateTransform()
-            # if self.request.destinationCrs().isValid() and self.request.destinationCrs() != self.source.provider.crs():
-            #     transform = QgsCoordinateTransform(self.source.provider.crs(), self.request.destinationCrs(), self.request.transformContext())
-            lookup = f"{self.source.provider._geom_field.name}__bboverlaps"
-            query = query.filter(**{lookup: GEOSGeometry(filter_rect.asWktPolygon())})
+        if not filter_rect.isNull() and self.source.provider._geom_field is not None:
+            query = self._filter_by_rect(query, filter_rect, self._exact_intersect)
 
         if self.request.filterType() == QgsFeatureRequest.FilterType.FilterFid:
-            query = query.filter(id=self.request.filterFid())
+            query = query.filter(pk=self.request.filterFid())
+
+        # Requested fids are fetched in one query, or in several if they exceed the backend's parameters limit
+        fids = self._requested_fids()
+        filter_fids = fids is not None
+        if filter_fids and len(fids) <= self.source.fids_chunk_size:
+            query = query.filter(pk__in=fids)
+            fids = None
+
+        self._filter_compiled = False
+        if self.request.filterType() == QgsFeatureRequest.FilterType.FilterExpression:
+            q, self._filter_compiled = self.source.compiler.compile(
+                self.request.filterExpression()
+            )
+            if q is not None:
+                query = query.filter(q)
+
+        # Order by (None if it can't be done by the database)
+        ordering = self._ordering(self.request.orderBy())
+        if ordering:
+            query = query.order_by(*ordering)
+        elif filter_fids:
+            # keep the order of the requested fids
+            query = query.order_by("pk")
+        client_side_filtering = self._subset_expression is not None or (
+            self.request.filterType() == QgsFeatureRequest.FilterType.FilterExpression
+            and not self._filter_compiled
+        )
 
-        # TODO : implement rest of filter, such as order_by, etc. (and expression ?)
+        query = self._prepare_values(query)
 
-        self.iterator = iter(query.all())
+        limit = self.request.limit()
+        if (
+            limit >= 0
+            and ordering is not None
+            and fids is None
+            and not client_side_filtering
+        ):
+            # The limit can only be applied by the database if it returns exactly the requested features
+            query = query[:limit]
+
+        self._close_iterator()
+        if fids is None:
+            self.iterator = self._iter_rows(query)
+        else:
+            self.iterator = self._iter_fids(query, fids)
         return True
 
+    def _iter_rows(self, query):
+        provider = self.source.provider
+        chunk_size = provider._chunk_size
+        if (
+            provider._background_fetch
+            and not connections[provider._db].in_atomic_block
+            and not holds(provider._db)
+        ):
+            # Rows are fetched by worker threads, unless this thread is in a transaction (whose uncommitted
+            # edits the workers' connections wouldn't see) or already holds a pooled connection (e.g. a
+            # provider method falling back to iterating features), which the worker would wait for
+            feedback = (
+                self.request.feedback() if hasattr(self.request, "feedback") else None
+            )
+            return fetch_rows(
+                query, provider._db, chunk_size, feedback, self.request.timeout()
+            )
+        if chunk_size > 0:
+            # Stream the rows instead of filling the queryset's result cache, so that memory stays bounded
+            # (see `stream_rows`)
+            return self._pooled_rows(stream_rows(query, chunk_size), provider._db)
+        return self._pooled_rows(query, provider._db)
+
+    def _pooled_rows(self, rows, alias):
+        """yields the rows using a pooled connection, held until the iterator is exhausted or closed"""
+        with pooled(alias):
+            yield from rows
+
+    def _filter_by_rect(self, query, rect, exact=False):
+        """
+        filters the rows whose bounding box intersects the rect (in the layer's CRS) using the spatial index,
+        and, if `exact`, whose geometry intersects it
+        """
+        provider = self.source.provider
+        geom_field = provider._geom_field
+        bbox = (rect.xMinimum(), rect.yMinimum(), rect.xMaximum(), rect.yMaximum())
+        envelope = Polygon.from_bbox(bbox)
+        envelope.srid = geom_field.srid
+        if provider._spatialite_index:
+            # Spatialite's MBR functions don't use the R-tree, which must be queried through `SpatialIndex`
+            table = geom_field.model._meta.db_table
+            params = [table, geom_field.column, *bbox]
+            query = query.filter(pk__in=RawSQL(SPATIALITE_INDEX_SQL, params))
+        else:
+            # This is the `&&` operator on PostGIS
+            query = query.filter(**{f"{geom_field.name}__bboverlaps": envelope})
+        if exact:
+            query = query.filter(**{f"{geom_field.name}__intersects": envelope})
+        return query
+
+    def _cacheable(self):
+        """whether the request can be served from the cache (plain or rect requests, without ordering)"""
+        return (
+            self.source.cache is not None
+            and self.request.filterType() == QgsFeatureRequest.FilterType.FilterNone
+            and not self.request.orderBy()
+        )
+
+    def _iter_cached(self, query, filter_rect):
+        """
+        yields the rows of the request from the cached blocks, fetching the missing blocks (the whole layer
+        for requests without rect, otherwise the tiles covering the rect)
+        """
+        source = self.source
+        if filter_rect.isNull() or source.provider._geom_field is None:
+            for row, _ in self._iter_block(source.cache_key("features"), query):
+                yield row
+            return
+
+        blocks = tiles(source.cache_grid, filter_rect) if source.cache_grid else None
+        if blocks is None:
+            # The rect is too big for the tiles grid (or the layer is empty), rows are fetched directly
+            yield from self._iter_rows(
+                self._filter_by_rect(query, filter_rect, self._exact_intersect)
+            )
+            return
+
+        seen = set()
+        for tile, tile_rect in blocks:
+            block = self._iter_block(
+                source.cache_key("features", (source.cache_grid, tile)),
+                self._filter_by_rect(query, tile_rect),
+                tile_rect,
+            )
+            for row, bbox in block:
+                # rows overlapping several tiles are in several blocks
+                if bbox is None or row[0] in seen or not bbox.intersects(filter_rect):
+                    continue
+                if self._exact_intersect and not self._intersects(row, filter_rect):
+                    continue
+                seen.add(row[0])
+                yield row
+
+    def _iter_block(self, key, query, rect=None):
+        """
+        yields the `(row, bbox)` tuples of a block, from the cache or from the query, in which case the
+        block is cached once fully consumed (unless it exceeds the cache size)
+        """
+        cache = self.source.cache
+        block = cache.get(key)
+        if block is not None:
+            yield from block
+            return
+
+        generation = cache.generation(key)
+        rows, size = [], 0
+        for row in self._iter_rows(query):
+            bbox = self._row_bbox(row)
+            yield row, bbox
+            if rows is not None:
+                rows.append((row, bbox))
+                size += row_size(row)
+                if size > cache.max_bytes:
+                    rows = None
+        if rows is not None:
+            fids = frozenset(row[0] for row, _ in rows)
+            cache.put(key, rows, size, fids, rect, generation)
+
+    def _row_bbox(self, row):
+        if self._geom_column is None or row[self._geom_column] is None:
+            return None
+        return wkb_to_qgs(row[self._geom_column]).boundingBox()
+
+    def _intersects(self, row, rect):
+        return wkb_to_qgs(row[self._geom_column]).intersects(rect)
+
+    def _iter_fids(self, query, fids):
+        """yields the rows of the requested fids, querying them by chunks"""
+        for fids_chunk in chunked(fids, self.source.fids_chunk_size):
+            yield from self._iter_rows(query.filter(pk__in=fids_chunk))
+
+    def _requested_fids(self):
+        """returns the sorted list of requested fids for FilterFids requests, None otherwise"""
+        if self.request.filterType() != QgsFeatureRequest.FilterType.FilterFids:
+            return None
+        return sorted(self.request.filterFids())
+
+    def _ordering(self, order_bys):
+        """returns the order by expressions, or None if ordering can't be done by the database"""
+        fids = self._requested_fids()
+        if order_bys and fids is not None and len(fids) > self.source.fids_chunk_size:
+            # fids are fetched by chunks, so the database can't order them all
+            return None
+        return self.source.compiler.compile_order_by(order_bys)
+
+    def prepareOrderBy(self, orderBys):
+        """tells QGIS that no sorting is needed when the order by is done by the database"""
+        return self._ordering(orderBys) is not None
+
+    def _prepare_values(self, query, all_columns=False):
+        """
+        Restricts the query to the needed columns (unless `all_columns` is set), returned as tuples with
+        the geometry encoded as WKB by the database, so that no model instance nor GEOS geometry is built
+        per row. Also computes the plan mapping the tuples columns to the feature's attributes indices.
+        """
+        provider = self.source.provider
+        flags = self.request.flags()
+
+        columns = ["pk"]
+
+        # Geometry is neither fetched nor decoded when the request doesn't need it
+        needs_geometry = (
+            all_columns
+            or not flags & QgsFeatureRequest.NoGeometry
+            or (
+                self._subset_expression is not None
+                and self._subset_expression.needsGeometry()
+            )
+        )
+        self._geom_column = None
+        if provider._geom_field is not None and needs_geometry:
+            query = query.annotate(**{WKB_ANNOTATION: AsWKB(provider._geom_field.name)})
+            self._geom_column = len(columns)
+            columns.append(WKB_ANNOTATION)
+
+        # Only select the requested attributes, others are left to NULL
+        attrs = provider._attrs()
+        if flags & QgsFeatureRequest.SubsetOfAttributes and not all_columns:
+            needed = set(self.request.subsetOfAttributes())
+            if self._subset_expression is not None:
+                needed |= set(
+                    self._subset_expression.referencedAttributeIndexes(
+                        self.source.fields
+                    )
+                )
+            indices = sorted(i for i in needed if 0 <= i < self.source.fields.count())
+        else:
+            indices = range(self.source.fields.count())
+
+        schema = provider._schema
+        self._attrs_plan = []
+        for index in indices:
+            if index == schema.pk_index:
+                # The pk value is already selected, this avoids joining the parent's table with multi-table
+                # inheritance when no other parent column is needed
+                self._attrs_plan.append((0, index))
+                continue
+            self._attrs_plan.append((len(columns), index))
+            if index < len(attrs):
+                # foreign keys are read as their raw value (`<name>_id`), without loading related objects
+                columns.append(attrs[index].attname)
+            else:
+                # computed attributes (display values, subtype) are joined in the same query
+                name, expression = schema.computed[index - len(attrs)]
+                query = query.annotate(**{name: expression})
+                columns.append(name)
+
+        return query.values_list(*columns)
+
     def close(self):
         """end of iterating: free the resources / lock"""
-        self.iterator = None
+        self._close_iterator()
+        if self._profile is not None:
+            recorder.finish(self._profile)
+            self._profile = None
         return True
 
+    def _close_iterator(self):
+        """releases the database cursor of a (possibly partially consumed) streaming iterator"""
+        if self.iterator is not None and hasattr(self.iterator, "close"):
+            self.iterator.close()
+        self.iterator = None
+
 
 class FeatureSource(QgsAbstractFeatureSource):
     def __init__(self, provider):
         super().__init__()
         self.provider = provider
+        self.fields = provider.fields()
+        self.crs = provider.crs()
+        self.compiler = provider._compiler
+        self.fids_chunk_size = provider._fids_chunk_size
+        self.queryset = provider._queryset()
+        self.subset_string = provider._subset_string
+        self.subset_complete = provider._subset_complete
+        self.cache = provider._cache
+        self.cache_grid = provider._cache_grid() if self.cache is not None else None
+        # cached rows of layers with different computed columns can't be shared
+        self.computed_columns = tuple(name for name, _ in provider._schema.computed)
+
+    def cache_key(self, kind, shape=None):
+        return cache_key(
+            self.provider.model,
+            kind,
+            self.subset_string,
+            shape,
+            self.computed_columns,
+        )
 
     def getFeatures(self, request):
         return QgsFeatureIterator(FeatureIterator(self, request))
@@ -113,16 +547,16 @@ class Provider(QgsVectorDataProvider):
     @classmethod
     def providerKey(cls):
         """Returns the memory provider key"""
-        return "qdmtk_provider"
+        return PROVIDER_KEY
 
     @classmethod
     def description(cls):
         """Returns the memory provider description"""
-        return "QDMTK Provider"
+        return PROVIDER_DESCRIPTION
 
     @classmethod
     def createProvider(cls, uri, providerOptions, flags=QgsDataProvider.ReadFlags()):
-        return Provider(uri, providerOptions, flags)
+        return cls(uri, providerOptions, flags)
 
     # Implementation of functions from QgsVectorDataProvider
 
@@ -135,22 +569,95 @@ class Provider(QgsVectorDataProvider):
         super().__init__(uri)
 
         self.uri = uri
+        model_name, self._options = parse_uri(uri)
+        self.model = find_model(model_name)
 
-        for model in django.apps.apps.get_models():
-            if model.__name__ == self.uri:
-                self.model = model
-                break
-        else:
-            known_models = [model.__name__ for model in django.apps.apps.get_models()]
-            raise Exception(
-                f"Could not find model {self.uri}. Known models are {known_models}"
-            )
+        # Number of rows per fetch when iterating features (0 disables streaming)
+        self._chunk_size = int(self._options.get("chunk_size", DEFAULT_CHUNK_SIZE))
+
+        # Number of rows the unique values are taken from (0 for all rows)
+        self._unique_values_sample = int(self._options.get("unique_values_sample", 0))
+
+        # Whether queries run on background worker threads
+        self._background_fetch = parse_bool(
+            self._options.get("background_fetch", False)
+        )
+
+        # Number of rows per query when writing features in bulk
+        self._batch_size = int(self._options.get("batch_size", DEFAULT_BATCH_SIZE))
+
+        # Whether features, counts and extents are cached in-process
+        self._cache = None
+        if parse_bool(self._options.get("cache", False)):
+            self._cache = feature_cache
+
+        # Whether the feature count and extent are estimated from the database statistics
+        self._estimated_metadata = parse_bool(
+            self._options.get("estimated_metadata", False)
+        )
 
-        # Find the first geometry field
-        self._geom_field = find_geom_field(self.model)
+        # Whether features have a subtype attribute (the label of their most specific model, with
+        # multi-table inheritance)
+        self._polymorphic = parse_bool(self._options.get("polymorphic", False))
+
+        # Whether foreign keys have an additional read-only attribute with the display value of the
+        # related row (its `qdmtk_display_field`), joined in the same query
+        self._display_fields = parse_bool(self._options.get("display_fields", False))
+
+        # Layer schema (attributes, fields and geometry field), shared by all providers of the model
+        self._schema = get_schema(
+            self.model,
+            polymorphic=self._polymorphic,
+            display_fields=self._display_fields,
+        )
+        self._geom_field = self._schema.geom_field
+
+        self._db = router.db_for_read(self.model)
+        self._fids_chunk_size = fids_chunk_size(self._db)
+        self._spatialite_index = self._uses_spatialite_index()
+        self._compiler = ExpressionCompiler(
+            self.model,
+            self._attrs(),
+            self._geom_field,
+            connections[self._db].vendor,
+        )
+
+        # Subset string, translated to a Q object (complete is False if it also needs client-side evaluation)
+        self._subset_string = ""
+        self._subset_filter = None
+        self._subset_complete = True
 
         self._extent = None
 
+        if self._cache is not None:
+            self._cache.watch(self.model, self._geom_field)
+
+    def _uses_spatialite_index(self):
+        """
+        Whether rect filters query Spatialite's R-tree, which requires a spatial index and integer pks
+        (matching the rowids)
+        """
+        connection = connections[self._db]
+        if not (
+            connection.vendor == "sqlite"
+            and getattr(connection.ops, "spatialite", False)
+        ):
+            return False
+        if self._geom_field is None or not self._geom_field.spatial_index:
+            return False
+        pk = self.model._meta.pk
+        while pk.is_relation:
+            # multi-table inheritance children use the parent's pk
+            pk = pk.target_field
+        return isinstance(pk, models.IntegerField)
+
+    def _queryset(self):
+        """Returns the queryset of the layer, prefiltered by the subset string"""
+        query = self.model.objects.all()
+        if self._subset_filter is not None:
+            query = query.filter(self._subset_filter)
+        return query
+
     def featureSource(self):
         return FeatureSource(self)
 
@@ -163,104 +670,319 @@ class Provider(QgsVectorDataProvider):
     def getFeatures(self, request=QgsFeatureRequest()):
         return self.featureSource().getFeatures(request)
 
-    def uniqueValues(self, fieldIndex, limit=1):
-        field = self._attrs_map()[fieldIndex]
-        return self.model.objects.values_list(field, flat=True).distinct()
+    def _values_query(self, fieldIndex, sample=False):
+        """
+        Returns the query of the field's values (if `sample`, from the number of rows set by the
+        `unique_values_sample` option) and the name of the values column, or (None, None) if it can't be
+        done by the database
+        """
+        if (
+            not self._subset_complete
+            or not 0 <= fieldIndex < self._schema.fields.count()
+        ):
+            return None, None
+        query = self._queryset().order_by()
+        if sample and self._unique_values_sample > 0:
+            sample = query.values("pk")[: self._unique_values_sample]
+            query = self.model.objects.filter(pk__in=sample)
+        if fieldIndex < len(self._attrs()):
+            column = self._attrs()[fieldIndex].attname
+        else:
+            column, expression = self._schema.computed[fieldIndex - len(self._attrs())]
+            query = query.annotate(**{column: expression})
+        return query.values_list(column, flat=True), column
+
+    @profiled("unique_values")
+    @pooled_method
+    def uniqueValues(self, fieldIndex, limit=-1):
+        query, _ = self._values_query(fieldIndex, sample=True)
+        if query is None:
+            return super().uniqueValues(fieldIndex, limit)
+        query = query.distinct()
+        if limit >= 0:
+            query = query[:limit]
+        return set(query)
+
+    @profiled("unique_strings_matching")
+    @pooled_method
+    def uniqueStringsMatching(self, index, substring, limit=-1, feedback=None):
+        query, column = self._values_query(index)
+        if query is None or self._schema.fields.at(index).type() != QVariant.String:
+            return super().uniqueStringsMatching(index, substring, limit, feedback)
+        query = query.filter(**{f"{column}__icontains": substring}).distinct()
+        if limit >= 0:
+            query = query[:limit]
+        results = []
+        for value in query.iterator():
+            if feedback is not None and feedback.isCanceled():
+                break
+            results.append(value)
+        return results
+
+    @profiled("minimum_value")
+    @pooled_method
+    def minimumValue(self, index):
+        return self._aggregate(index, Min, super().minimumValue)
+
+    @profiled("maximum_value")
+    @pooled_method
+    def maximumValue(self, index):
+        return self._aggregate(index, Max, super().maximumValue)
+
+    def _aggregate(self, index, function, fallback):
+        query, column = self._values_query(index)
+        if query is None:
+            return fallback(index)
+        value = query.aggregate(value=function(column))["value"]
+        return NULL if value is None else value
 
     def wkbType(self):
         if self._geom_field is None:
             return QgsWkbTypes.NoGeometry
         return QgsWkbTypes.parseType(self._geom_field.geom_type)
 
+    @profiled("count")
+    @pooled_method
     def featureCount(self):
-        return self.model.objects.count()
+        return self._cached("count", self._count)
 
-    def _attrs(self):
-        """
-        Yields SQLAlchemy's attributes (non-geom)
-        """
-        for field in self.model._meta.get_fields():
-            if isinstance(field, (models.OneToOneField, models.ManyToOneRel)):
-                # Skip non-field attributes
-                continue
-            if field is self._geom_field:
-                # Skip the geometry field, which is not an attribute
-                continue
-            yield field
+    def _count(self):
+        if self._estimated_metadata and not self._subset_string:
+            count = estimated_count(self._db, self.model, self._geom_field)
+            if count is not None:
+                return count
+        if not self._subset_complete:
+            # The subset string is partly evaluated client-side, so features are counted one by one
+            request = QgsFeatureRequest()
+            request.setFlags(QgsFeatureRequest.NoGeometry)
+            request.setNoAttributes()
+            return sum(1 for _ in self.getFeatures(request))
+        return self._queryset().count()
 
-    def _attrs_map(self) -> "dict[int, str]":
+    def _attrs(self):
         """
-        Returns a dict that maps field idx to field name
+        Returns the model's fields exposed as attributes (non-geom)
         """
-        return {i: attr.name for i, attr in enumerate(self._attrs())}
+        return self._schema.attrs
 
     def fields(self):
-        fields = QgsFields()
-        for attr in self._attrs():
-            if isinstance(attr, models.ForeignKey):
-                field = attr.target_field
-            else:
-                field = attr
-
-            if isinstance(field, (models.TextField, models.CharField)):
-                type_ = QVariant.String
-            elif isinstance(field, models.IntegerField):
-                type_ = QVariant.Int
-            elif isinstance(field, (models.FloatField, models.DecimalField)):
-                type_ = QVariant.Double
-            elif isinstance(field, models.DateField):
-                type_ = QVariant.Date
-            elif isinstance(field, models.BooleanField):
-                type_ = QVariant.Bool
-            else:
-                QgsMessageLog.logMessage(
-                    f"Field type not configured : {field.__class__.__name__} ({attr.name})",
-                )
-                type_ = QVariant.Invalid
-            fields.append(QgsField(attr.name, type_))
-        return fields
+        return QgsFields(self._schema.fields)
 
+    @profiled("add_features")
+    @pooled_method
     def addFeatures(self, flist, flags=None):
-        for f in flist:
-            instance = self.model()
-            setattr(instance, self._geom_field.name, GEOSGeometry(f.geometry().asWkt()))
-            for attr in self._attrs():
-                value = f.attribute(attr.name)
-                setattr(instance, attr.name, value if value != NULL else None)
-            instance.save()
+        bulk = self._use_bulk_create()
+        try:
+            with timing("instances"):
+                instances = [self._instance_from_feature(f, bulk) for f in flist]
+            with transaction.atomic(using=self._db):
+                if bulk:
+                    self.model.objects.bulk_create(
+                        instances, batch_size=self._batch_size
+                    )
+                else:
+                    for instance in instances:
+                        instance.save()
+        except Exception as e:
+            # not only database errors (e.g. invalid values), the edit session must be rolled back anyway
+            QgsMessageLog.logMessage(f"Could not add features ({e})", "QDMTK")
+            mark_failed(self._db)
+            return False, flist
+
+        # Write back the fids of the created rows
+        for f, instance in zip(flist, instances):
+            pk = instance.pk
+            f.setId(string_to_fid(pk) if isinstance(pk, str) else pk)
+        self._invalidate_cache(
+            fids=[instance.pk for instance in instances],
+            rects=[f.geometry().boundingBox() for f in flist if f.hasGeometry()],
+            created=True,
+        )
         return True, flist
 
+    def _instance_from_feature(self, f, bulk=False):
+        instance = self.model()
+        if self._geom_field is not None:
+            geometry = self._geometry_value(f.geometry(), bulk)
+            setattr(instance, self._geom_field.name, geometry)
+        for attr in self._attrs():
+            value = f.attribute(attr.name)
+            setattr(instance, attr.attname, value if value != NULL else None)
+        return instance
+
+    def _geometry_value(self, geometry, bulk):
+        """
+        Returns the value of the geometry field, decoded by the database for bulk writes, or as a GEOS
+        geometry for writes going through `save()`
+        """
+        if bulk:
+            return qgs_to_db(geometry, self._geom_field)
+        return qgs_to_geos(geometry, self._geom_field.srid)
+
+    def _use_bulk_create(self):
+        """
+        Whether new features can be inserted with bulk_create, which requires the model to allow bulk
+        writes, not to use multi-table inheritance and the backend to return the created pks
+        """
+        return (
+            supports_bulk_writes(self.model)
+            and not self.model._meta.parents
+            and connections[self._db].features.can_return_rows_from_bulk_insert
+        )
+
+    @profiled("delete_features")
+    @pooled_method
     def deleteFeatures(self, ids):
-        for instance in self.model.objects.filter(id__in=ids):
-            instance.delete()
+        try:
+            with transaction.atomic(using=self._db):
+                for fids_chunk in chunked(sorted(ids), self._fids_chunk_size):
+                    query = self.model.objects.filter(pk__in=fids_chunk)
+                    if supports_bulk_writes(self.model, method="delete"):
+                        # Cascades are collected once for the whole chunk
+                        query.delete()
+                    else:
+                        for instance in query:
+                            instance.delete()
+        except Exception as e:
+            QgsMessageLog.logMessage(f"Could not delete features ({e})", "QDMTK")
+            mark_failed(self._db)
+            return False
+        self._invalidate_cache(fids=ids, deleted=True)
+        # layers of other models may reference the rows (whether or not this layer is cached)
+        feature_cache.invalidate_referencing(self.model, self._db)
+        return True
 
+    @profiled("change_attribute_values")
     def changeAttributeValues(self, attr_map):
-        attrs_map = self._attrs_map()
-        for fid, attrs in attr_map.items():
-            instance = self.model.objects.get(id=fid)
-            for k, value in attrs.items():
-                setattr(instance, attrs_map[k], value if value != NULL else None)
-            instance.save()
-        return True
+        attrs = self._attrs()
+        changes = {}
+        for fid, values in attr_map.items():
+            changes[fid] = {}
+            for k, value in values.items():
+                if k >= len(attrs) or attrs[k].primary_key:
+                    # primary keys are the fids, they can't be changed (nor can computed attributes)
+                    continue
+                changes[fid][attrs[k]] = value if value != NULL else None
+        return self._change_values(changes)
 
+    @profiled("change_geometry_values")
     def changeGeometryValues(self, geometry_map):
-        for fid, geometry in geometry_map.items():
-            instance = self.model.objects.get(id=fid)
-            setattr(instance, self._geom_field.name, GEOSGeometry(geometry.asWkt()))
-            instance.save()
+        bulk = supports_bulk_writes(self.model)
+        changes = {
+            fid: {self._geom_field: self._geometry_value(geometry, bulk)}
+            for fid, geometry in geometry_map.items()
+        }
+        rects = [g.boundingBox() for g in geometry_map.values() if not g.isNull()]
+        return self._change_values(changes, rects)
+
+    @pooled_method
+    def _change_values(self, changes, rects=()):
+        """
+        Applies changes (as `{fid: {field: value}}`) in a single transaction. Instances are loaded with
+        in_bulk and saved with one bulk_update per set of changed fields, unless the model doesn't support
+        bulk writes, in which case each instance is saved.
+        """
+        try:
+            with transaction.atomic(using=self._db):
+                with timing("instances"):
+                    instances = self.model.objects.in_bulk(list(changes.keys()))
+
+                    groups = defaultdict(list)
+                    for fid, values in changes.items():
+                        instance = instances.get(fid)
+                        if instance is None or not values:
+                            continue
+                        for field, value in values.items():
+                            setattr(instance, field.attname, value)
+                        groups[tuple(sorted(field.name for field in values))].append(
+                            instance
+                        )
+
+                if supports_bulk_writes(self.model):
+                    for fields, group in groups.items():
+                        self.model.objects.bulk_update(
+                            group, fields, batch_size=self._batch_size
+                        )
+                else:
+                    for group in groups.values():
+                        for instance in group:
+                            instance.save()
+        except Exception as e:
+            QgsMessageLog.logMessage(f"Could not change features ({e})", "QDMTK")
+            mark_failed(self._db)
+            return False
+        self._invalidate_cache(fids=list(changes), rects=rects)
+        # layers of other models may show the rows' display values
+        feature_cache.invalidate_referencing(self.model, self._db)
         return True
 
+    def _cached(self, kind, compute):
+        """Returns the cached value (count or extent) of the layer, computing it if needed"""
+        if self._cache is None:
+            return compute()
+        key = cache_key(self.model, kind, self._subset_string)
+        value = self._cache.get(key)
+        if value is None:
+            value = compute()
+            self._cache.put(key, value)
+        return value
+
+    def _cache_grid(self):
+        """Returns the tiles grid of the cached feature blocks, aligned on the extent (None if empty)"""
+
+        def compute():
+            extent = self.extent()
+            if extent.isNull() or extent.isEmpty():
+                return None
+            return (
+                extent.xMinimum(),
+                extent.yMinimum(),
+                extent.width(),
+                extent.height(),
+            )
+
+        return self._cached("grid", compute)
+
+    def _invalidate_cache(self, **kwargs):
+        if self._cache is not None:
+            self._cache.invalidate_on_commit(self.model, self._db, **kwargs)
+
     def allFeatureIds(self):
-        return self.model.objects.values_list("id", flat=True)
+        if not self._subset_complete:
+            request = QgsFeatureRequest()
+            request.setFlags(QgsFeatureRequest.NoGeometry)
+            request.setNoAttributes()
+            return [f.id() for f in self.getFeatures(request)]
+        return self._queryset().values_list("id", flat=True)
 
     def subsetString(self):
-        return ""
+        return self._subset_string
 
-    def setSubsetString(self, subsetString):
-        raise NotImplementedError()
+    def setSubsetString(self, subsetString, updateFeatureCount=True):
+        """
+        Sets the subset string, which is a QGIS expression. The supported parts of the expression are
+        translated to the ORM, the rest is evaluated client-side.
+        """
+        if subsetString:
+            expression = QgsExpression(subsetString)
+            if expression.hasParserError():
+                QgsMessageLog.logMessage(
+                    f"Invalid subset string {subsetString} : {expression.parserErrorString()}",
+                    "QDMTK",
+                )
+                return False
+            self._subset_filter, self._subset_complete = self._compiler.compile(
+                expression
+            )
+        else:
+            self._subset_filter, self._subset_complete = None, True
+        self._subset_string = subsetString or ""
+        self._extent = None
+        self.dataChanged.emit()
+        return True
 
     def supportsSubsetString(self):
-        return False
+        return True
 
     def capabilities(self):
         return (
@@ -281,22 +1003,31 @@ class Provider(QgsVectorDataProvider):
             self.updateExtents()
         return self._extent
 
+    @profiled("extent")
+    @pooled_method
     def updateExtents(self):
-        extents = self.model.objects.aggregate(extent=Extent(self._geom_field.name))[
+        self._extent = self._cached("extent", self._compute_extent)
+
+    def _compute_extent(self):
+        if self._estimated_metadata and not self._subset_string:
+            extent = estimated_extent(self._db, self.model, self._geom_field)
+            if extent is not None:
+                return extent
+        # NOTE : if the subset string is partly evaluated client-side, this is the extent of the prefiltered rows
+        extents = self._queryset().aggregate(extent=Extent(self._geom_field.name))[
             "extent"
         ]
         if extents:
-            self._extent = QgsRectangle(extents[0], extents[1], extents[2], extents[3])
-        else:
-            self._extent = QgsRectangle()
+            return QgsRectangle(extents[0], extents[1], extents[2], extents[3])
+        return QgsRectangle()
 
     def isValid(self):
         return True
 
     def crs(self):
         crs = QgsCoordinateReferenceSystem()
-        srid = self._geom_field.srid
-        crs.createFromString(f"EPSG:{srid}")
+        if self._geom_field is not None:
+            crs.createFromString(f"EPSG:{self._geom_field.srid}")
         return crs
 
     def handlePostCloneOperations(self, source):
@@ -1,6 +1,64 @@
+from types import MappingProxyType
+
 from django.apps import apps
 
 from . import datamodels_registry
+from .exceptions import QDMTKException
+
+# Indices built by `build_index()` once Django is set up
+_index = {
+    # Maps each app label to the alias of the datamodel that installed it
+    "alias_by_app_label": MappingProxyType({}),
+    # Maps each alias to the labels of the apps installed by its datamodel
+    "app_labels_by_alias": MappingProxyType({}),
+    # Maps model names (both `ModelName` and `app_label.ModelName`) to models, or to None if ambiguous
+    "model_by_name": MappingProxyType({}),
+}
+
+
+def build_index():
+    """
+    Builds the app label -> alias and model name -> model indices. This is called by `prepare_django()`.
+    """
+    alias_by_app_label = {}
+    app_labels_by_alias = {}
+    for datamodel_key, datamodel in datamodels_registry.items():
+        app_labels_by_alias[datamodel_key] = frozenset()
+        for app in apps.get_app_configs():
+            if app.name in datamodel["apps"]:
+                alias_by_app_label.setdefault(app.label, datamodel_key)
+                app_labels_by_alias[datamodel_key] |= {app.label}
+
+    model_by_name = {}
+    for model in apps.get_models():
+        model_by_name[model._meta.label] = model
+        name = model.__name__
+        model_by_name[name] = None if name in model_by_name else model
+
+    _index["alias_by_app_label"] = MappingProxyType(alias_by_app_label)
+    _index["app_labels_by_alias"] = MappingProxyType(app_labels_by_alias)
+    _index["model_by_name"] = MappingProxyType(model_by_name)
+
+
+def find_model(name):
+    """
+    Returns the model with the given name (`ModelName`, or `app_label.ModelName` if the name is used by
+    several apps)
+    """
+    if not _index["model_by_name"]:
+        build_index()
+    try:
+        model = _index["model_by_name"][name]
+    except KeyError:
+        known_models = sorted(n for n in _index["model_by_name"] if "." in n)
+        raise QDMTKException(
+            f"Could not find model {name}. Known models are {known_models}"
+        )
+    if model is None:
+        raise QDMTKException(
+            f"Model name {name} is ambiguous, use `app_label.{name}` instead"
+        )
+    return model
 
 
 class QDMTKDatabaseRouter:
@@ -11,11 +69,14 @@ class QDMTKDatabaseRouter:
     registry = {}
 
     def db_for_read(self, model, **hints):
-        app = apps.get_app_config(model._meta.app_label)
-        for datamodel_key in datamodels_registry:
-            if app.name in datamodels_registry[datamodel_key]["apps"]:
-                return datamodel_key
-        raise Exception(f"No datamodel found {model} (of app {model._meta.app_label})")
+        if not _index["alias_by_app_label"]:
+            build_index()
+        try:
+            return _index["alias_by_app_label"][model._meta.app_label]
+        except KeyError:
+            raise Exception(
+                f"No datamodel found {model} (of app {model._meta.app_label})"
+            )
 
     def db_for_write(self, model, **hints):
         return self.db_for_read(model, **hints)
@@ -33,5 +94,6 @@ class QDMTKDatabaseRouter:
 
         # Otherwise, we only run if the model's app is listed as an installed app of the given
         # datamodel.
-        app = apps.get_app_config(app_label)
-        return app.name in datamodels_registry[db]["apps"]
+        if not _index["app_labels_by_alias"]:
+            build_index()
+        return app_label in _index["app_labels_by_alias"].get(db, ())
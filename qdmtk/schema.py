@@ -0,0 +1,182 @@
+from typing import NamedTuple
+
+from django.contrib.gis.db import models
+from django.db.models import Case, F, Value, When
+from django.db.models.signals import post_migrate
+from qgis.core import QgsField, QgsFields, QgsMessageLog
+from qgis.PyQt.QtCore import QVariant
+
+from .utils import find_geom_field
+
+# Computed schemas by model and options
+_schemas = {}
+
+# Name of the attribute holding the model label of each row's most specific class, for polymorphic layers
+SUBTYPE_FIELD = "qdmtk_subtype"
+
+# Suffix of the attributes holding the display value of foreign keys, for layers with display fields
+DISPLAY_SUFFIX = "_display"
+
+
+class LayerSchema(NamedTuple):
+    """
+    Describes how a model maps to a QGIS layer. Schemas are immutable, computed once per model and
+    shared by all providers and feature sources of that model.
+    """
+
+    model: type
+    # Model fields exposed as attributes, in the order of the field indices
+    attrs: tuple
+    fields: QgsFields
+    geom_field: models.GeometryField
+    # Index of the attribute holding the pk's value (the parent's pk with multi-table inheritance), which
+    # is read from the pk column instead of joining the parent's table
+    pk_index: int
+    # Read-only attributes following the model's attributes, as `(name, expression)` computed in the
+    # query (foreign keys display values, then the subtype)
+    computed: tuple
+
+
+def get_schema(model, polymorphic=False, display_fields=False):
+    """
+    Returns the (cached) schema of the model
+    """
+    key = (model, polymorphic, display_fields)
+    schema = _schemas.get(key)
+    if schema is None:
+        schema = _schemas[key] = build_schema(model, polymorphic, display_fields)
+    return schema
+
+
+def clear_schemas(**kwargs):
+    """
+    Invalidates the computed schemas (called after migrations)
+    """
+    _schemas.clear()
+
+
+post_migrate.connect(clear_schemas, dispatch_uid="qdmtk_clear_schemas")
+
+
+def build_schema(model, polymorphic=False, display_fields=False):
+    geom_field = find_geom_field(model)
+
+    attrs = []
+    for field in model._meta.get_fields():
+        if isinstance(field, (models.OneToOneField, models.ManyToOneRel)):
+            # Skip non-field attributes
+            continue
+        if field is geom_field:
+            # Skip the geometry field, which is not an attribute
+            continue
+        attrs.append(field)
+
+    pk = model._meta.pk
+    while pk.is_relation:
+        # multi-table inheritance children share the parent's pk value
+        pk = pk.target_field
+    pk_index = next((i for i, attr in enumerate(attrs) if attr is pk), None)
+
+    fields = QgsFields()
+    for attr in attrs:
+        fields.append(QgsField(attr.name, field_type(attr)))
+
+    computed = []
+    if display_fields:
+        names = {field.name for field in model._meta.get_fields()}
+        for attr in attrs:
+            display_field = find_display_field(attr)
+            name = f"{attr.name}{DISPLAY_SUFFIX}"
+            if display_field is None or name in names:
+                continue
+            fields.append(read_only_field(name, field_type(display_field)))
+            computed.append((name, F(f"{attr.name}__{display_field.name}")))
+
+    # Lookups (e.g. `building`, `building__tallbuilding`) and labels of the multi-table inheritance
+    # children, most specific first
+    subtypes = tuple(child_lookups(model)) if polymorphic else ()
+    if subtypes:
+        fields.append(read_only_field(SUBTYPE_FIELD, QVariant.String))
+        computed.append((SUBTYPE_FIELD, subtype_expression(model, subtypes)))
+
+    return LayerSchema(
+        model=model,
+        attrs=tuple(attrs),
+        fields=fields,
+        geom_field=geom_field,
+        pk_index=pk_index,
+        computed=tuple(computed),
+    )
+
+
+def read_only_field(name, type_):
+    """Returns the field of a computed attribute, which can't be edited"""
+    field = QgsField(name, type_)
+    field.setReadOnly(True)
+    return field
+
+
+def find_display_field(attr):
+    """
+    Returns the field of the related model set as its display value (with the `qdmtk_display_field`
+    attribute) if the attribute is a foreign key, or None
+    """
+    if not isinstance(attr, models.ForeignKey):
+        return None
+    related_model = attr.related_model
+    name = getattr(related_model, "qdmtk_display_field", None)
+    if name is None:
+        return None
+    return related_model._meta.get_field(name)
+
+
+def child_lookups(model, prefix=""):
+    """
+    Yields the `(lookup, label)` of the multi-table inheritance children of the model, most specific first
+    """
+    for relation in model._meta.related_objects:
+        if not (relation.one_to_one and relation.field.remote_field.parent_link):
+            continue
+        child = relation.related_model
+        lookup = f"{prefix}{relation.get_accessor_name()}"
+        yield from child_lookups(child, f"{lookup}__")
+        yield lookup, child._meta.label
+
+
+def subtype_expression(model, subtypes):
+    """
+    Returns the expression of the subtype attribute, resolved with LEFT JOINs on the children's tables
+    """
+    return Case(
+        *(
+            When(**{f"{lookup}__isnull": False}, then=Value(label))
+            for lookup, label in subtypes
+        ),
+        default=Value(model._meta.label),
+        output_field=models.CharField(),
+    )
+
+
+def field_type(attr):
+    """
+    Returns the QVariant type matching a model field
+    """
+    if isinstance(attr, models.ForeignKey):
+        field = attr.target_field
+    else:
+        field = attr
+
+    if isinstance(field, (models.TextField, models.CharField)):
+        return QVariant.String
+    elif isinstance(field, models.IntegerField):
+        return QVariant.Int
+    elif isinstance(field, (models.FloatField, models.DecimalField)):
+        return QVariant.Double
+    elif isinstance(field, models.DateField):
+        return QVariant.Date
+    elif isinstance(field, models.BooleanField):
+        return QVariant.Bool
+    QgsMessageLog.logMessage(
+        f"Field type not configured : {field.__class__.__name__} ({attr.name})",
+    )
+    return QVariant.Invalid
@@ -0,0 +1,157 @@
+"""
+Edit sessions, committing the edits of layers of a datamodel in a single transaction.
+
+When a layer using the Django provider commits its edit buffer, an atomic block is opened on the datamodel's
+database, and closed on the same thread when the layer's commit returns. Each provider edit method runs in
+a savepoint, and if any of them fails (or if QGIS fails the commit, noticed on the next iteration of the
+event loop or the layer's next commit), the whole session is rolled back. Sessions opened explicitly with
+`edit_session()` group the commits of several layers in a single transaction.
+
+Sessions are scoped to the thread committing the layers (as are Django connections).
+"""
+
+import threading
+from contextlib import contextmanager
+
+from django.db import DatabaseError, transaction
+from qgis.core import Qgis, QgsMessageLog
+from qgis.PyQt.QtCore import QTimer
+
+# Currently opened sessions of the thread by database alias
+_local = threading.local()
+
+
+def _sessions():
+    if not hasattr(_local, "sessions"):
+        _local.sessions = {}
+    return _local.sessions
+
+
+class EditSession:
+    def __init__(self, alias, explicit=False):
+        self.alias = alias
+        self.explicit = explicit
+        self.layers = []
+        self.failed = False
+        self._atomic = transaction.atomic(using=alias)
+        self._atomic.__enter__()
+
+    def close(self):
+        """commits the transaction (or rolls it back if some edit failed), returns whether it was committed"""
+        if self.failed:
+            transaction.set_rollback(True, using=self.alias)
+        try:
+            self._atomic.__exit__(None, None, None)
+        except DatabaseError as e:
+            QgsMessageLog.logMessage(f"Could not commit edits ({e})", "QDMTK")
+            self.failed = True
+        return not self.failed
+
+
+def begin_edit_session(alias, layer=None):
+    """
+    Opens an edit session on the database if none is opened yet by the thread. Sessions opened this way
+    are closed by `end_edit_session()` when the layer's commit succeeds, or rolled back when it fails.
+    """
+    sessions = _sessions()
+    session = sessions.get(alias)
+    if session is not None and not session.explicit and layer in session.layers:
+        # left open by a previous commit of the layer which failed outside of the provider
+        rollback_edit_session(alias, session)
+        session = None
+    if session is None:
+        session = sessions[alias] = EditSession(alias)
+        if threading.current_thread() is threading.main_thread():
+            # QGIS doesn't signal failed commits, the session is still open once the event loop runs again
+            QTimer.singleShot(0, lambda: rollback_edit_session(alias, session))
+    if layer is not None:
+        session.layers.append(layer)
+    return session
+
+
+def end_edit_session(alias, explicit=False):
+    """
+    Closes the edit session of the database opened by the thread, returns whether the edits were committed.
+    Explicit sessions are only closed by their `edit_session()` block.
+    """
+    sessions = _sessions()
+    session = sessions.get(alias)
+    if session is None or session.explicit != explicit:
+        return True
+    del sessions[alias]
+    committed = session.close()
+    if not committed:
+        notify_rollback(alias, session.layers)
+    return committed
+
+
+def rollback_edit_session(alias, session):
+    """
+    Rolls back the session if it's still the thread's session of the database (i.e. the layer's commit
+    failed)
+    """
+    if _sessions().get(alias) is not session:
+        return
+    session.failed = True
+    end_edit_session(alias)
+
+
+def notify_rollback(alias, layers):
+    """
+    Tells the user which layers' edits were rolled back. Their edit buffers were already flushed, so they
+    are reloaded to show the database's state.
+    """
+    names = ", ".join(layer.name() for layer in layers) or alias
+    message = f"Edits of {names} were rolled back, see the QDMTK log for the errors"
+    QgsMessageLog.logMessage(message, "QDMTK", level=Qgis.Critical)
+
+    from qgis.utils import iface
+
+    if iface is not None and threading.current_thread() is threading.main_thread():
+        iface.messageBar().pushMessage("QDMTK", message, level=Qgis.Critical)
+    for layer in layers:
+        layer.reload()
+
+
+def mark_failed(alias):
+    """
+    Marks the current edit session of the database (if any) to be rolled back. Sessions opened by a layer's
+    commit are rolled back right away, as QGIS stops committing the layer.
+    """
+    session = _sessions().get(alias)
+    if session is None:
+        return
+    session.failed = True
+    if not session.explicit:
+        end_edit_session(alias)
+
+
+@contextmanager
+def edit_session(alias):
+    """
+    Groups the edits of several layers in a single transaction explicitly, e.g. :
+
+        with edit_session("demo_project_a"):
+            structures_layer.commitChanges()
+            buildings_layer.commitChanges()
+    """
+    sessions = _sessions()
+    if alias in sessions:
+        yield sessions[alias]
+        return
+    session = sessions[alias] = EditSession(alias, explicit=True)
+    try:
+        yield session
+    except Exception:
+        session.failed = True
+        raise
+    finally:
+        end_edit_session(alias, explicit=True)
+
+
+def watch_layer(layer, alias):
+    """
+    Makes the layer's commits run in an edit session on the database
+    """
+    layer.beforeCommitChanges.connect(lambda *args: begin_edit_session(alias, layer))
+    layer.afterCommitChanges.connect(lambda: end_edit_session(alias))
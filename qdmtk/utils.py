@@ -1,4 +1,14 @@
+from urllib.parse import parse_qsl
+
 from django.contrib.gis.db import models
+from django.db import connections
+from django.db.models.signals import post_save, pre_save
+
+# Number of query parameters kept available for other filters when filtering by lists of fids
+RESERVED_QUERY_PARAMS = 100
+
+# Maximum number of fids per query on backends without parameters limit
+MAX_FIDS_CHUNK_SIZE = 10000
 
 
 def string_to_fid(string):
@@ -11,6 +21,72 @@ def string_to_fid(string):
         return 0
 
 
+def parse_uri(uri):
+    """
+    Splits a provider uri of the form `ModelName?option=value&...` into the model name
+    and a dict of layer options
+    """
+    model_name, _, query = uri.partition("?")
+    return model_name, dict(parse_qsl(query))
+
+
+def parse_bool(value):
+    """
+    Parses a boolean layer option (e.g. `1`, `true`, `yes`)
+    """
+    return str(value).lower() in ("1", "true", "yes", "on")
+
+
+def chunked(items, size):
+    """
+    Yields lists of at most `size` items
+    """
+    for i in range(0, len(items), size):
+        yield items[i : i + size]
+
+
+def stream_rows(query, chunk_size):
+    """
+    Yields the rows of a `values_list` query (whose first column is the pk) by chunks of `chunk_size`.
+
+    On Postgres, Django declares server-side cursors `WITH HOLD` in autocommit mode, which makes Postgres
+    compute the whole result before returning the first row. Unordered queries are instead paginated on the
+    pk (each chunk being a `pk > last ORDER BY pk LIMIT chunk_size` query), so that the first rows come
+    quickly whatever the table size.
+    """
+    connection = connections[query.db]
+    if (
+        connection.vendor != "postgresql"
+        or connection.in_atomic_block
+        or query.query.order_by
+        or query.query.is_sliced
+    ):
+        # outside of Postgres' autocommit mode, server-side cursors stream the rows
+        yield from query.iterator(chunk_size=chunk_size)
+        return
+
+    query = query.order_by("pk")
+    last = None
+    while True:
+        page = query if last is None else query.filter(pk__gt=last)
+        rows = list(page[:chunk_size])
+        yield from rows
+        if len(rows) < chunk_size:
+            return
+        last = rows[-1][0]
+
+
+def fids_chunk_size(alias):
+    """
+    Returns how many fids can be used in a `pk__in` filter, respecting the backend's query parameters
+    limit (e.g. the max variables number of SQLite)
+    """
+    max_query_params = connections[alias].features.max_query_params
+    if max_query_params is None:
+        return MAX_FIDS_CHUNK_SIZE
+    return max(1, min(max_query_params - RESERVED_QUERY_PARAMS, MAX_FIDS_CHUNK_SIZE))
+
+
 def find_geom_field(model):
     for field in model._meta.get_fields():
         if isinstance(field, models.GeometryField):
@@ -18,5 +94,32 @@ def find_geom_field(model):
     return None
 
 
-def find_pk_field(model):
-    return model._meta.pk
+def supports_bulk_writes(model, method="save"):
+    """
+    Whether edits can bypass the model's `save()` (or `delete()`) method and use bulk queries. This can be
+    set with the `qdmtk_bulk_writes` attribute on the model, and defaults to True unless the method is
+    overridden (or, for saves, unless pre_save/post_save receivers are connected for the model).
+    """
+    bulk_writes = getattr(model, "qdmtk_bulk_writes", None)
+    if bulk_writes is None:
+        if method == "save" and has_save_receivers(model):
+            # bulk_create/bulk_update don't send pre_save/post_save
+            return False
+        return getattr(model, method) is getattr(models.Model, method)
+    return bulk_writes
+
+
+def has_save_receivers(model):
+    """
+    Whether pre_save/post_save receivers are connected for the model (or for all models), ignoring
+    qdmtk's own receivers (which are identified by their `qdmtk_` dispatch uid)
+    """
+    senders = (id(model), id(None))
+    for signal in (pre_save, post_save):
+        for (receiver_key, sender_key), *_ in signal.receivers:
+            if sender_key not in senders:
+                continue
+            if isinstance(receiver_key, str) and receiver_key.startswith("qdmtk_"):
+                continue
+            return True
+    return False